@@ -0,0 +1,301 @@
+"""
+End-to-end benchmark of the scheduled pipeline (mpro.process_anime), a backfill
+of several episodes (core.backfill) and the /dl flow (bot.process_download) with
+no live services.
+
+The downloaders are benchmarks/fake_downloader.py, which synthesizes inputs with
+ffmpeg's lavfi sources. Telegram is benchmarks/mock_telegram.MockClient, which
+simulates uplink bandwidth and FloodWait. AniList is benchmarks/stub_anilist.py.
+Every configuration runs in its own subprocess, so peak RSS is per run.
+
+    python benchmarks/bench_pipeline.py [--mode pipeline|backfill|dl|both] [--shows 1,4] [--qualities 3]
+        [--jobs 4] [--seconds 20] [--bitrate 4M] [--uplink-mbps 200] [--flood-rate 0.05]
+        [--save-baseline base.json] [--baseline base.json]
+
+Reports episode latency, the time spent in each stage (from metrics.py spans),
+peak scratch disk and peak RSS. With --baseline, it also prints the change
+against a saved run.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import resource
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+FAKE_DOWNLOADER = os.path.join(HERE, "fake_downloader.py")
+STAGES = ("download", "mdnx_download", "anilist_request", "thumbnail_download", "thumbnail_render", "merge", "upload")
+
+
+# ---------------- CHILD: ONE CONFIGURATION ---------------- #
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass   # deleted while walking
+    return total
+
+
+async def watch_disk(paths, peak: list):
+    while True:
+        peak[0] = max(peak[0], sum(dir_size(p) for p in paths))
+        await asyncio.sleep(0.1)
+
+
+def prepare_env(scratch: str, cfg: dict):
+    """Point every store and workspace into `scratch`; must run before the bot modules are imported."""
+    os.environ.update({
+        "WORKSPACE_ROOT": os.path.join(scratch, "jobs"),
+        "DETAILS_DB": os.path.join(scratch, "details.db"),
+        "FILE_ID_DB": os.path.join(scratch, "file_ids.db"),
+        "DOWNLOAD_QUEUE_DB": os.path.join(scratch, "downloads.db"),
+        "ANILIST_CACHE_PATH": os.path.join(scratch, "anilist_cache.db"),
+        "THUMB_CACHE_DIR": os.path.join(scratch, "thumb_cache"),
+        "MULTI_DL_PATH": os.path.join(scratch, "mdnx"),
+        "MDNX_CMD": f"{sys.executable} {FAKE_DOWNLOADER} mdnx",
+        "FAKE_MDNX_SECONDS": str(cfg["seconds"]),
+        "FAKE_MDNX_BITRATE": cfg["bitrate"],
+        "STREAM_UPLOAD": "1" if cfg["stream"] else "0",
+        "UPLOAD_BOT_TOKENS": "",
+        "METRICS_PORT": "0",
+        "MAX_JOBS": str(cfg["jobs"]),
+    })
+    if cfg["chat_rate"]:
+        os.environ["TG_GROUP_CHAT_RATE"] = os.environ["TG_PRIVATE_CHAT_RATE"] = str(cfg["chat_rate"])
+    sys.path.insert(0, ROOT)
+
+
+async def bench_pipeline(cfg: dict, client) -> list:
+    import mpro
+    from data import get_anime_info
+    from pipeline import JobScheduler
+    from uploader import UploadPool
+
+    mpro.upload_pool = UploadPool([client])
+    latencies = []
+
+    async def show(name: str, submitted: float):
+        # what new.py does before downloading: metadata + cover
+        await get_anime_info(f"[SubsPlease] {name} - S01E01 (1080p) [ABCD1234].mkv")
+        slug = name.lower().replace(" ", "-")
+        await mpro.process_anime(
+            name,
+            f"{sys.executable} {FAKE_DOWNLOADER} video --name {slug} --qualities {cfg['qualities']} "
+            f"--seconds {cfg['seconds']} --bitrate {cfg['bitrate']} --mbps {cfg['download_mbps']}",
+            f"{sys.executable} {FAKE_DOWNLOADER} audio --name {slug} --seconds {cfg['seconds']} "
+            f"--mbps {cfg['download_mbps']}",
+        )
+        latencies.append(time.monotonic() - submitted)
+
+    scheduler = JobScheduler()
+    scheduler.start()
+    for i in range(cfg["shows"]):
+        name = f"Bench Show {i + 1}"
+        await scheduler.submit(name, lambda name=name, t=time.monotonic(): show(name, t))
+    await scheduler.join()
+    await scheduler.stop()
+    return latencies
+
+
+async def bench_backfill(cfg: dict, client) -> list:
+    import core
+    import mpro
+    from details import get_details
+    from uploader import UploadPool
+
+    mpro.upload_pool = UploadPool([client])
+    core.SHOWS["Bench Show"] = (
+        f"{sys.executable} {FAKE_DOWNLOADER} video --name bench-show --qualities {cfg['qualities']} "
+        f"--seconds {cfg['seconds']} --bitrate {cfg['bitrate']} --mbps {cfg['download_mbps']}",
+        f"{sys.executable} {FAKE_DOWNLOADER} audio --name bench-show --seconds {cfg['seconds']} "
+        f"--mbps {cfg['download_mbps']}",
+    )
+    latencies = []
+    process_anime = mpro.process_anime
+
+    async def timed(*args):
+        await process_anime(*args)
+        latencies.append(time.monotonic() - started)
+
+    core.job_queue.start()
+    started = time.monotonic()
+    await core.backfill(timed, "Bench Show", 1, cfg["shows"])
+    await core.job_queue.join()
+    await core.job_queue.stop()
+    if get_details("Bench Show")["episode"] != cfg["shows"] + 1:
+        raise RuntimeError(f"episode counter at {get_details('Bench Show')['episode']} after the backfill")
+    return latencies
+
+
+async def bench_dl(cfg: dict, client) -> list:
+    import bot
+    import download_queue
+    from uploader import UploadPool
+
+    bot.app = client
+    bot.upload_pool = UploadPool([client])
+    latencies = []
+    process_download = bot.process_download
+
+    async def timed(job):
+        await process_download(job)
+        latencies.append(time.monotonic() - enqueued)
+
+    bot.process_download = timed
+    enqueued = time.monotonic()
+    for i in range(cfg["shows"]):
+        download_queue.enqueue(
+            1000 + i, 1000 + i, f"G{i}", [str(e) for e in range(1, cfg["qualities"] + 1)],
+            "jpn", "en", "jpn", "en", "1080"
+        )
+    workers = [asyncio.ensure_future(bot.download_worker()) for _ in range(bot.DL_WORKERS)]
+    bot.queue_changed.set()
+    while download_queue.list_jobs():
+        await asyncio.sleep(0.2)
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    return latencies
+
+
+async def run_child(cfg: dict) -> dict:
+    scratch = tempfile.mkdtemp(prefix="bench_pipeline_")
+    prepare_env(scratch, cfg)
+    from stub_anilist import StubAniList
+    from mock_telegram import MockClient
+
+    stub = StubAniList(cfg["anilist_latency"])
+    os.environ["ANILIST_URL"] = await stub.start()
+    from data import close_session
+    from metrics import metrics
+
+    client = MockClient(uplink_mbps=cfg["uplink_mbps"], flood_rate=cfg["flood_rate"],
+                        flood_seconds=cfg["flood_seconds"])
+    peak = [0]
+    watcher = asyncio.ensure_future(watch_disk([scratch], peak))
+    started = time.monotonic()
+    try:
+        run = {"pipeline": bench_pipeline, "backfill": bench_backfill, "dl": bench_dl}[cfg["mode"]]
+        latencies = await run(cfg, client)
+    finally:
+        wall = time.monotonic() - started
+        watcher.cancel()
+        await close_session()
+        await stub.stop()
+        subprocess.run(["rm", "-rf", scratch])
+
+    stages = metrics.snapshot()["stages"]
+    return {
+        "config": cfg,
+        "wall_seconds": round(wall, 2),
+        "episodes": len(latencies),
+        "latency_avg": round(sum(latencies) / len(latencies), 2) if latencies else None,
+        "latency_max": round(max(latencies), 2) if latencies else None,
+        "stages": {name: stages[name]["total_seconds"] for name in STAGES if name in stages},
+        "peak_disk_mib": round(peak[0] / 2**20, 1),
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "uploaded_mib": round(client.uploaded / 2**20, 1),
+        "flood_waits": client.floods,
+        "anilist_requests": stub.requests,
+    }
+
+
+# ---------------- PARENT: MATRIX + REPORT ---------------- #
+def run_config(cfg: dict) -> dict:
+    out = subprocess.run(
+        [sys.executable, __file__, "--child", json.dumps(cfg)], cwd=HERE, capture_output=True, text=True
+    )
+    if out.returncode != 0:
+        raise SystemExit(f"{cfg['mode']} run failed:\n{out.stderr[-4000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def config_key(cfg: dict) -> str:
+    return f"{cfg['mode']}:shows={cfg['shows']}:q={cfg['qualities']}:jobs={cfg['jobs']}"
+
+
+def report(result: dict, baseline: dict = None):
+    cfg = result["config"]
+    base = (baseline or {}).get(config_key(cfg))
+
+    def delta(field, value):
+        if not base or base.get(field) in (None, 0) or value is None:
+            return ""
+        return f" ({(value - base[field]) / base[field]:+.0%})"
+
+    print(f"\n== {cfg['mode']}: {cfg['shows']} show(s) × {cfg['qualities']} qualit(ies), {cfg['jobs']} job(s), "
+          f"{cfg['seconds']}s @ {cfg['bitrate']}, uplink {cfg['uplink_mbps']} Mbit/s, "
+          f"flood rate {cfg['flood_rate']}, stream={cfg['stream']}")
+    for field, unit in (("wall_seconds", "s"), ("latency_avg", "s"), ("latency_max", "s"),
+                        ("peak_disk_mib", " MiB"), ("peak_rss_mib", " MiB"), ("uploaded_mib", " MiB")):
+        print(f"  {field:<16} {result[field]}{unit}{delta(field, result[field])}")
+    for name, seconds in result["stages"].items():
+        base_stage = (base or {}).get("stages", {}).get(name)
+        change = f" ({(seconds - base_stage) / base_stage:+.0%})" if base_stage else ""
+        print(f"  stage {name:<18} {seconds:8.2f}s{change}")
+    print(f"  flood waits {result['flood_waits']}, AniList requests {result['anilist_requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=("pipeline", "backfill", "dl", "both"), default="both")
+    parser.add_argument("--shows", default="1,4", help="comma-separated show counts (backfill: episodes, /dl: users)")
+    parser.add_argument("--qualities", default="3", help="comma-separated qualities per show (/dl: episodes)")
+    parser.add_argument("--jobs", default="4", help="comma-separated MAX_JOBS values (episodes at once)")
+    parser.add_argument("--seconds", type=float, default=20, help="length of each synthetic episode")
+    parser.add_argument("--bitrate", default="4M", help="1080p bitrate; lower qualities scale down")
+    parser.add_argument("--download-mbps", type=float, default=0, help="simulated download speed, 0 = unthrottled")
+    parser.add_argument("--uplink-mbps", type=float, default=200)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="chance a send/edit gets a FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=3)
+    parser.add_argument("--anilist-latency", type=float, default=0.05)
+    parser.add_argument("--chat-rate", type=float, default=0, help="override Telegram per-chat sends/s")
+    parser.add_argument("--stream", action="store_true", help="STREAM_UPLOAD=1 (needs ffprobe)")
+    parser.add_argument("--baseline", help="compare against results saved with --save-baseline")
+    parser.add_argument("--save-baseline", help="write the results as a baseline JSON file")
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, HERE)
+        print(json.dumps(asyncio.run(run_child(json.loads(args.child)))))
+        return
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    modes = ("pipeline", "dl") if args.mode == "both" else (args.mode,)
+    results = {}
+    for mode, shows, qualities, jobs in itertools.product(
+        modes, [int(x) for x in args.shows.split(",")], [int(x) for x in args.qualities.split(",")],
+        [int(x) for x in args.jobs.split(",")]
+    ):
+        cfg = {
+            "mode": mode, "shows": shows, "qualities": min(qualities, 3) if mode != "dl" else qualities, "jobs": jobs,
+            "seconds": args.seconds, "bitrate": args.bitrate, "download_mbps": args.download_mbps,
+            "uplink_mbps": args.uplink_mbps, "flood_rate": args.flood_rate, "flood_seconds": args.flood_seconds,
+            "anilist_latency": args.anilist_latency, "chat_rate": args.chat_rate, "stream": args.stream,
+        }
+        result = run_config(cfg)
+        results[config_key(cfg)] = result
+        report(result, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline written to {args.save_baseline}")
+
+
+if __name__ == "__main__":
+    main()
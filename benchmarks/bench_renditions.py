@@ -0,0 +1,85 @@
+"""
+Single-decode multi-rendition transcode vs one ffmpeg process per rendition.
+
+Generates a synthetic 1080p source with ffmpeg's lavfi sources, then makes the
+lower renditions both ways: media.make_renditions (decode once, split filter,
+one libx264 encoder per height) and a separate decode + encode per height.
+Reports wall time and the CPU time the ffmpeg children used.
+
+    python benchmarks/bench_renditions.py [--seconds 60] [--heights 480,720] [--threads 0] [--runs 2]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from media import FFMPEG_BIN, make_renditions, rendition_args, run_ffmpeg
+
+
+def child_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def make_source(workdir: str, seconds: int) -> str:
+    source = os.path.join(workdir, "source_1080p.mp4")
+    await run_ffmpeg(["-f", "lavfi", "-i", f"testsrc2=size=1920x1080:rate=24:duration={seconds}",
+                      "-c:v", "libx264", "-preset", "ultrafast", "-b:v", "6M", source])
+    return source
+
+
+async def single_decode(source: str, outputs: dict, threads: int):
+    await make_renditions(source, outputs, threads)
+
+
+async def per_rendition(source: str, outputs: dict, threads: int):
+    # what a naive "ffmpeg -vf scale" per quality costs: the source is decoded once per output
+    for h, path in outputs.items():
+        await run_ffmpeg(rendition_args(source, {h: path}, threads))
+
+
+async def measure(name: str, fn, source: str, outputs: dict, threads: int, runs: int) -> dict:
+    walls, cpus = [], []
+    for _ in range(runs):
+        cpu, start = child_cpu(), time.monotonic()
+        await fn(source, outputs, threads)
+        walls.append(time.monotonic() - start)
+        cpus.append(child_cpu() - cpu)
+        for path in outputs.values():
+            os.remove(path)
+    return {"name": name, "wall": min(walls), "cpu": min(cpus)}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--heights", default="480,720")
+    parser.add_argument("--threads", type=int, default=0, help="TRANSCODE_THREADS, 0 = ffmpeg decides")
+    parser.add_argument("--runs", type=int, default=2)
+    args = parser.parse_args()
+
+    print(f"ffmpeg: {FFMPEG_BIN}, {os.cpu_count()} CPUs")
+    with tempfile.TemporaryDirectory() as workdir:
+        source = await make_source(workdir, args.seconds)
+        outputs = {int(h): os.path.join(workdir, f"out_{h}p.mp4") for h in args.heights.split(",")}
+        results = [
+            await measure("single decode", single_decode, source, outputs, args.threads, args.runs),
+            await measure("per rendition", per_rendition, source, outputs, args.threads, args.runs),
+        ]
+
+    base = results[0]
+    print(f"\n{args.seconds}s 1080p source -> {', '.join(f'{h}p' for h in sorted(outputs))}, "
+          f"threads={args.threads or 'auto'}, best of {args.runs}")
+    for r in results:
+        print(f"  {r['name']:<14} wall {r['wall']:7.2f}s ({r['wall'] / base['wall']:.2f}x)  "
+              f"cpu {r['cpu']:7.2f}s ({r['cpu'] / base['cpu']:.2f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
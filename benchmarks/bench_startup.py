@@ -0,0 +1,122 @@
+"""
+Cold-start benchmark: time from process start until an entry point has handled
+its first message (/start for mpro.py and new.py, /stats for bot.py).
+
+Each run is a fresh interpreter. It imports the entry point, starts the same
+background startup work main() does that needs no network (the metrics server,
+and for the scheduled bots, the scheduler), and feeds one message to the command
+handler while that work runs. Telegram itself is not contacted.
+
+    python benchmarks/bench_startup.py [--entries mpro,new,bot] [--runs 5] [--target 1.5]
+
+Exits non-zero if the median of any entry point is above --target seconds. Also
+lists which heavy optional modules had been loaded by the time the message was
+answered; ones imported on a background thread may or may not show up.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from types import SimpleNamespace
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+HEAVY = ("aiohttp", "apscheduler", "pytz", "PIL", "anitopy")
+
+
+# ---------------- CHILD: ONE COLD START ---------------- #
+class Message(SimpleNamespace):
+    async def reply(self, text, **kwargs):
+        self.answered = time.time()
+
+    reply_text = reply
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def first_message(entry: str, spawned: float) -> dict:
+    imported = time.time()
+    module = __import__(entry)
+    imported = time.time() - imported
+    from metrics import start_metrics_server
+
+    startup = [asyncio.ensure_future(start_metrics_server(port=free_port()))]
+    if entry == "bot":
+        handler, text = module.show_stats, "/stats"
+    else:
+        import core
+        handler, text = module.command_handler if entry == "mpro" else module.start, "/start"
+        startup.append(asyncio.ensure_future(core.schedule_jobs(module.process_anime)))
+
+    await asyncio.sleep(0)   # let the startup work begin, as it would under a running bot
+    message = Message(text=text, from_user=SimpleNamespace(id=1), chat=SimpleNamespace(id=1), command=[text[1:]])
+    await handler(None, message)
+    loaded = sorted(name for name in HEAVY if name in sys.modules)
+
+    for task in startup:
+        task.cancel()
+    await asyncio.gather(*startup, return_exceptions=True)
+    return {"first_message": message.answered - spawned, "import": imported, "heavy_loaded": loaded}
+
+
+# ---------------- PARENT ---------------- #
+def cold_start(entry: str, scratch: str) -> dict:
+    env = dict(
+        os.environ,
+        DETAILS_DB=os.path.join(scratch, "details.db"),
+        FILE_ID_DB=os.path.join(scratch, "file_ids.db"),
+        DOWNLOAD_QUEUE_DB=os.path.join(scratch, "downloads.db"),
+        MULTI_DL_PATH=os.path.join(scratch, "mdnx"),
+        WORKSPACE_ROOT=os.path.join(scratch, "jobs"),
+        UPLOAD_BOT_TOKENS="",
+    )
+    spawned = time.time()
+    out = subprocess.run(
+        [sys.executable, __file__, "--child", entry, "--spawned", repr(spawned)],
+        cwd=scratch, env=env, capture_output=True, text=True
+    )
+    if out.returncode != 0:
+        raise SystemExit(f"{entry} failed:\n{out.stderr[-4000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--spawned", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--entries", default="mpro,new,bot")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--target", type=float, default=1.5, help="max median seconds to the first reply")
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, ROOT)
+        print(json.dumps(asyncio.run(first_message(args.child, args.spawned))))
+        return
+
+    failed = []
+    for entry in args.entries.split(","):
+        with tempfile.TemporaryDirectory(prefix="bench_startup_") as scratch:
+            runs = [cold_start(entry, scratch) for _ in range(args.runs)]
+        first = sorted(r["first_message"] for r in runs)[len(runs) // 2]
+        imported = sorted(r["import"] for r in runs)[len(runs) // 2]
+        status = "ok" if first <= args.target else "SLOW"
+        print(f"{entry:<5} first message {first:.3f}s (import {imported:.3f}s) "
+              f"target {args.target:.2f}s {status}; heavy modules loaded: {', '.join(runs[-1]['heavy_loaded']) or 'none'}")
+        if first > args.target:
+            failed.append(entry)
+    if failed:
+        sys.exit(f"over target: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
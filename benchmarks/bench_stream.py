@@ -0,0 +1,104 @@
+"""
+Streaming remux-and-upload vs merge-to-disk-then-upload.
+
+Generates a synthetic video/audio pair with ffmpeg's lavfi sources, then pushes
+it through both paths into a fake Telegram client that only counts bytes and
+sleeps to simulate the uplink. Reports episode latency and peak scratch disk.
+
+    python benchmarks/bench_stream.py [--seconds 120] [--bitrate 8M] [--uplink-mbps 200]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from media import FFMPEG_BIN, STREAM_CHUNK_SIZE, merge_video_audio, remux_stream
+from uploader import upload_stream
+
+
+class FakeClient:
+    """Just enough of pyrogram.Client for upload_stream()."""
+
+    def __init__(self, uplink_mbps: float):
+        self.bytes_per_sec = uplink_mbps * 1_000_000 / 8
+        self.uploaded = 0
+
+    def rnd_id(self):
+        return random.getrandbits(63)
+
+    async def invoke(self, query):
+        self.uploaded += len(query.bytes)
+        await asyncio.sleep(len(query.bytes) / self.bytes_per_sec)
+        return True
+
+
+async def read_chunks(path: str):
+    with open(path, "rb") as f:
+        while chunk := f.read(STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+async def watch_disk(path: str, peak: list):
+    while True:
+        peak[0] = max(peak[0], dir_size(path))
+        await asyncio.sleep(0.02)
+
+
+async def make_inputs(workdir: str, seconds: int, bitrate: str):
+    video, audio = os.path.join(workdir, "video.mp4"), os.path.join(workdir, "audio.m4a")
+    for args in (
+        ["-f", "lavfi", "-i", f"testsrc2=size=1920x1080:rate=24:duration={seconds}",
+         "-c:v", "libx264", "-preset", "ultrafast", "-b:v", bitrate, video],
+        ["-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}", "-c:a", "aac", audio],
+    ):
+        process = await asyncio.create_subprocess_exec(FFMPEG_BIN, "-loglevel", "error", "-y", *args)
+        await process.wait()
+    return video, audio
+
+
+async def run_mode(mode: str, video: str, audio: str, uplink_mbps: float):
+    scratch = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    client, peak = FakeClient(uplink_mbps), [0]
+    watcher = asyncio.ensure_future(watch_disk(scratch, peak))
+    start = time.perf_counter()
+
+    if mode == "disk":
+        merged = os.path.join(scratch, "merged.mp4")
+        await merge_video_audio(video, audio, merged)
+        await upload_stream(client, read_chunks(merged), "merged.mp4")
+        os.remove(merged)
+    else:
+        await upload_stream(client, remux_stream(video, audio), "merged.mp4")
+
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    os.rmdir(scratch)
+    print(f"{mode:<8} latency {elapsed:7.2f}s   peak scratch {peak[0] / 2**20:8.1f} MiB   "
+          f"uploaded {client.uploaded / 2**20:8.1f} MiB")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=int, default=120)
+    parser.add_argument("--bitrate", default="8M")
+    parser.add_argument("--uplink-mbps", type=float, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_inputs_") as workdir:
+        video, audio = await make_inputs(workdir, args.seconds, args.bitrate)
+        for mode in ("disk", "stream"):
+            await run_mode(mode, video, audio, args.uplink_mbps)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
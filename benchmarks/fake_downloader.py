@@ -0,0 +1,129 @@
+"""
+Stand-in for the real downloader scripts: synthesizes inputs with ffmpeg's
+lavfi sources instead of fetching them.
+
+    fake_downloader.py video --name solo-leveling [--qualities 3] [--seconds 20] [--bitrate 4M] [--mbps 0]
+            [--latest | --episode N]
+        writes <name>_<height>p.mp4 per quality into $DOWNLOAD_PATH (or ./downloads)
+    fake_downloader.py audio --name solo-leveling [--seconds 20] [--mbps 0] [--latest | --episode N]
+        writes <name>.m4a into $AUDIO_PATH (or ./audio)
+    fake_downloader.py mdnx <MDNX arguments>
+        behaves like `npx ts-node -T ./index.ts`: --autoLogin writes session.json,
+        otherwise writes videos/<--fileName>.mp4 and prints progress percentages
+
+Every file gets a random comment tag so identical settings never produce
+byte-identical files (which the file_id cache would short-circuit).
+`--mbps` stretches each file to that download speed.
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import subprocess
+
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
+RESOLUTIONS = [(640, 360), (1280, 720), (1920, 1080)]
+
+
+def synthesize(path: str, seconds: float, video: tuple = None, bitrate: str = None, progress: bool = False):
+    if video:
+        w, h = video
+        args = ["-f", "lavfi", "-i", f"testsrc2=size={w}x{h}:rate=24:duration={seconds}",
+                "-c:v", "libx264", "-preset", "ultrafast", "-b:v", bitrate]
+    else:
+        args = ["-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}", "-c:a", "aac"]
+    cmd = [FFMPEG_BIN, "-hide_banner", "-nostdin", "-loglevel", "error", "-y", *args,
+           "-metadata", f"comment={uuid.uuid4().hex}", path]
+    if not progress:
+        subprocess.run(cmd, check=True)
+        return
+
+    process = subprocess.Popen(cmd[:-1] + ["-progress", "pipe:1", path], stdout=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        if key == "out_time_us" and value.isdigit():
+            print(f"Downloading... {min(100.0, int(value) / 1e6 / seconds * 100):.1f}%", flush=True)
+    if process.wait():
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    print("Downloading... 100%", flush=True)
+
+
+def throttle_to(path: str, started: float, mbps: float):
+    if mbps > 0:
+        time.sleep(max(0.0, os.path.getsize(path) * 8 / (mbps * 1e6) - (time.monotonic() - started)))
+
+
+def scale_bitrate(bitrate: str, height: int) -> str:
+    value = float(bitrate.rstrip("kKmM")) * (1000 if bitrate[-1] in "kK" else 1e6 if bitrate[-1] in "mM" else 1)
+    return str(int(value * height / 1080))
+
+
+def video_mode(argv):
+    parser = argparse.ArgumentParser(prog="fake_downloader.py video")
+    parser.add_argument("--name", required=True)
+    parser.add_argument("--latest", action="store_true")
+    parser.add_argument("--episode", type=int)
+    parser.add_argument("--qualities", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--bitrate", default="4M")
+    parser.add_argument("--mbps", type=float, default=0)
+    args = parser.parse_args(argv)
+
+    out = os.environ.get("DOWNLOAD_PATH", "./downloads")
+    os.makedirs(out, exist_ok=True)
+    for w, h in RESOLUTIONS[-args.qualities:]:
+        started = time.monotonic()
+        path = os.path.join(out, f"{args.name}_{h}p.mp4")
+        synthesize(path, args.seconds, (w, h), scale_bitrate(args.bitrate, h))
+        throttle_to(path, started, args.mbps)
+
+
+def audio_mode(argv):
+    parser = argparse.ArgumentParser(prog="fake_downloader.py audio")
+    parser.add_argument("--name", required=True)
+    parser.add_argument("--latest", action="store_true")
+    parser.add_argument("--episode", type=int)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--mbps", type=float, default=0)
+    args = parser.parse_args(argv)
+
+    out = os.environ.get("AUDIO_PATH", "./audio")
+    os.makedirs(out, exist_ok=True)
+    started = time.monotonic()
+    path = os.path.join(out, f"{args.name}.m4a")
+    synthesize(path, args.seconds)
+    throttle_to(path, started, args.mbps)
+
+
+def mdnx_mode(argv):
+    parser = argparse.ArgumentParser(prog="fake_downloader.py mdnx")
+    parser.add_argument("--autoLogin", action="store_true")
+    parser.add_argument("--srz", default="SEASON")
+    parser.add_argument("-e", default="1")
+    parser.add_argument("-q", default="0")
+    parser.add_argument("--fileName", default="[${service}] ${showTitle} - S${season}E${episode} [${height}p]")
+    parser.add_argument("--seconds", type=float, default=float(os.environ.get("FAKE_MDNX_SECONDS", 20)))
+    parser.add_argument("--bitrate", default=os.environ.get("FAKE_MDNX_BITRATE", "4M"))
+    args, _ = parser.parse_known_args(argv)
+
+    if args.autoLogin:
+        with open("session.json", "w") as f:
+            f.write("{}")
+        return
+
+    w, h = RESOLUTIONS[-1]
+    name = args.fileName
+    for key, value in {"service": "crunchy", "showTitle": f"Show {args.srz}", "season": "1",
+                       "episode": args.e, "height": str(h)}.items():
+        name = name.replace("${" + key + "}", value)
+    path = os.path.join("videos", name + ".mp4")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    synthesize(path, args.seconds, (w, h), args.bitrate, progress=True)
+
+
+if __name__ == "__main__":
+    modes = {"video": video_mode, "audio": audio_mode, "mdnx": mdnx_mode}
+    if len(sys.argv) < 2 or sys.argv[1] not in modes:
+        sys.exit(__doc__)
+    modes[sys.argv[1]](sys.argv[2:])
@@ -0,0 +1,109 @@
+"""
+Mock pyrogram.Client for the benchmarks: no network, uploads take
+size / uplink time on one shared link per client, and any send or edit can be
+answered with a FloodWait.
+"""
+import os
+import random
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+from pyrogram import raw
+from pyrogram.errors import FloodWait
+from pyrogram.parser import Parser
+
+PART_SIZE = 512 * 1024
+
+
+class MockMessage(SimpleNamespace):
+    pass
+
+
+class MockClient:
+    def __init__(self, bot_id: int = 1, uplink_mbps: float = 200, flood_rate: float = 0.0,
+                 flood_seconds: int = 3, seed: int = 0):
+        self.me = SimpleNamespace(id=bot_id, username=f"mock_bot_{bot_id}")
+        self.bytes_per_sec = uplink_mbps * 1_000_000 / 8
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.parser = Parser(None)
+        self.uploaded = 0
+        self.floods = 0
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._link = asyncio.Lock()
+
+    # ---- simulation ---- #
+    def _maybe_flood(self):
+        self.calls += 1
+        if self.flood_rate and self._rng.random() < self.flood_rate:
+            self.floods += 1
+            raise FloodWait(value=self.flood_seconds)
+
+    async def _transfer(self, size: int):
+        for offset in range(0, size, PART_SIZE):
+            part = min(PART_SIZE, size - offset)
+            async with self._link:
+                await asyncio.sleep(part / self.bytes_per_sec)
+            self.uploaded += part
+
+    async def _upload(self, media) -> str:
+        """A local path is uploaded; anything else is a file_id/URL and costs nothing."""
+        if isinstance(media, str) and os.path.isfile(media):
+            await self._transfer(os.path.getsize(media))
+        return f"mock_file_{next(self._ids)}"
+
+    def _message(self, chat_id, kind: str = None, file_id: str = None, text: str = None):
+        message = MockMessage(id=next(self._ids), chat=SimpleNamespace(id=chat_id), text=text,
+                              media=SimpleNamespace(value=kind) if kind else None)
+        if kind:
+            setattr(message, kind, SimpleNamespace(file_id=file_id))
+        return message
+
+    # ---- pyrogram surface used by the bots ---- #
+    def rnd_id(self):
+        return self._rng.getrandbits(63)
+
+    async def resolve_peer(self, chat_id):
+        return raw.types.InputPeerEmpty()
+
+    async def invoke(self, query):
+        if isinstance(query, (raw.functions.upload.SaveFilePart, raw.functions.upload.SaveBigFilePart)):
+            await self._transfer(len(query.bytes))
+            return True
+        self._maybe_flood()
+        return SimpleNamespace(updates=[], users=[], chats=[])
+
+    async def save_file(self, path, **kwargs):
+        await self._upload(path)
+        return raw.types.InputFile(id=self.rnd_id(), parts=1, name=os.path.basename(path), md5_checksum="")
+
+    async def get_chat(self, chat_id):
+        return SimpleNamespace(id=chat_id)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self._maybe_flood()
+        return self._message(chat_id, text=text)
+
+    async def _send_media(self, kind, chat_id, media, caption="", **kwargs):
+        self._maybe_flood()
+        return self._message(chat_id, kind, await self._upload(media), caption)
+
+    async def send_video(self, chat_id, video, caption="", **kwargs):
+        return await self._send_media("video", chat_id, video, caption)
+
+    async def send_document(self, chat_id, document, caption="", **kwargs):
+        return await self._send_media("document", chat_id, document, caption)
+
+    async def send_photo(self, chat_id, photo, caption="", **kwargs):
+        return await self._send_media("photo", chat_id, photo, caption)
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self._maybe_flood()
+        return self._message(chat_id, text=text)
+
+    async def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        self._maybe_flood()
+        return self._message(chat_id)
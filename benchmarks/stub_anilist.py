@@ -0,0 +1,107 @@
+"""
+Local stand-in for graphql.anilist.co: answers the aliased batch queries from
+data.build_batch_query (by search or by ID) with made-up media, and serves
+generated JPEG covers. Like AniList, it ANDs id, search and seasonYear: an ID
+sent with a search that isn't that show's title finds nothing.
+
+Searches in `missing` get a null alias plus an `errors` entry (HTTP 404, as
+AniList answers a partly failed batch); the next `throttle` requests get a 429
+with `retry_after`. `batches` keeps the variables of every request.
+"""
+import asyncio
+import hashlib
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+
+class StubAniList:
+    def __init__(self, latency: float = 0.05, cover_size=(460, 650)):
+        self.latency = latency
+        self.cover_size = cover_size
+        self.requests = 0
+        self.url = None
+        self._runner = None
+        self._cover = None
+        self._titles = {}     # id -> (title, year), for lookups by ID
+        self.missing = set()
+        self.throttle = 0
+        self.retry_after = "1"
+        self.batches = []
+
+    def _media(self, title: str, year) -> dict:
+        media_id = int(hashlib.md5(title.encode()).hexdigest()[:6], 16)
+        self._titles.setdefault(media_id, (title, year))
+        return {
+            "id": media_id,
+            "title": {"english": title, "romaji": title, "native": title},
+            "synonyms": [f"{title} TV"],
+            "description": f"<b>{title}</b> is a synthetic show. " * 20,
+            "episodes": 12,
+            "genres": ["Action", "Fantasy"],
+            "status": "RELEASING",
+            "season": "FALL",
+            "seasonYear": year,
+            "averageScore": 80,
+            "coverImage": {"large": f"{self.url}/cover/{media_id}.jpg", "extraLarge": f"{self.url}/cover/{media_id}.jpg"},
+            "bannerImage": None,
+            "siteUrl": f"{self.url}/anime/{media_id}",
+        }
+
+    async def _graphql(self, request):
+        body = await request.json()
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.throttle:
+            self.throttle -= 1
+            return web.json_response(
+                {"data": None, "errors": [{"message": "Too Many Requests.", "status": 429}]}, status=429,
+                headers={"Retry-After": self.retry_after, "X-RateLimit-Limit": "90", "X-RateLimit-Remaining": "0"}
+            )
+        variables = body.get("variables", {})
+        self.batches.append(variables)
+        data, errors = {}, []
+        for i in {key[1:] for key in variables if key[0] in "siy"}:
+            if variables.get(f"s{i}") in self.missing:
+                data[f"m{i}"] = None
+                errors.append({"message": "Not Found.", "status": 404, "path": [f"m{i}"]})
+            else:
+                data[f"m{i}"] = self._match(variables.get(f"i{i}"), variables.get(f"s{i}"), variables.get(f"y{i}"))
+        body = {"data": data, "errors": errors} if errors else {"data": data}
+        return web.json_response(body, status=404 if errors else 200,
+                                 headers={"X-RateLimit-Limit": "90", "X-RateLimit-Remaining": "89"})
+
+    def _match(self, media_id, search, year):
+        if media_id is None:
+            return self._media(search, year) if search else None
+        if media_id not in self._titles:
+            return None
+        title, known_year = self._titles[media_id]
+        if search is not None and search.lower() not in title.lower():
+            return None
+        if year is not None and known_year is not None and year != known_year:
+            return None
+        return self._media(title, known_year)
+
+    async def _cover_jpeg(self, request):
+        if self._cover is None:
+            out = BytesIO()
+            Image.effect_mandelbrot(self.cover_size, (-2, -1.5, 1, 1.5), 100).convert("RGB").save(out, "JPEG")
+            self._cover = out.getvalue()
+        await asyncio.sleep(self.latency)
+        return web.Response(body=self._cover, content_type="image/jpeg")
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        server = web.Application()
+        server.add_routes([web.post("/", self._graphql), web.get("/cover/{name}", self._cover_jpeg)])
+        self._runner = web.AppRunner(server, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        await self._runner.cleanup()
@@ -1,7 +1,16 @@
 import os
-import subprocess
-import glob
-from pyrogram import Client, filters
+import re
+import time
+import shutil
+import asyncio
+from collections import deque
+import download_queue
+from data import close_session
+from metrics import metrics, profile_job, span, start_metrics_server
+from pipeline import DiskBudget, dir_size, sweep_loop
+from throttle import throttle
+from uploader import UploadPool, file_fingerprint
+from pyrogram import Client, filters, idle
 from pyrogram.types import Message
 
 # ------------------- CONFIG -------------------
@@ -10,23 +19,135 @@ API_HASH = os.environ.get("API_HASH", "0fec896446625478537e43906a4829f8")
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "7662286847:AAEkI_-OQPZck3jhJM6BrKM1JSgp2l43Td4")
 
 # Paths
-MULTI_DL_PATH = "/home/ubuntu/Ac"      # cloned repo
+MULTI_DL_PATH = os.environ.get("MULTI_DL_PATH", "/home/ubuntu/Ac")      # cloned repo
+MDNX_CMD = os.environ.get("MDNX_CMD", "npx ts-node -T ./index.ts").split()  # how to start MDNX in it
 VIDEOS_PATH = os.path.join(MULTI_DL_PATH, "videos") # where MDNX stores videos
 LOG_PATH = os.path.join(VIDEOS_PATH, "download.log") # log file path
+DL_WORKERS = int(os.environ.get("DL_WORKERS", 2))    # concurrent MDNX downloads
+# MDNX's default file name; each job prefixes it with its own folder (MDNX creates
+# folders for path separators in --fileName)
+MDNX_FILENAME = "[${service}] ${showTitle} - S${season}E${episode} [${height}p]"
+VIDEO_EXTENSIONS = (".mkv", ".mp4")
 
 # Ensure folders exist
 os.makedirs(VIDEOS_PATH, exist_ok=True)
 
 # ----------------------------------------------
 app = Client("crunchyroll_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
+upload_pool = UploadPool.from_env(app, API_ID, API_HASH)   # + UPLOAD_BOT_TOKENS helpers
 
 # ------------------- Helper Functions -------------------
-def run_mdnx(season_id, episode, dub_lang, dl_subs, default_audio, default_sub, qual):
+LOG_FLUSH_INTERVAL = 2.0         # seconds between batched log/console writes
+PROGRESS_EDIT_INTERVAL = 5.0     # seconds between status message edits
+LOG_TAIL_LINES = 200             # downloader output kept in memory
+FAILURE_TAIL_LINES = 10          # of which shown in a "download failed" notice
+PROGRESS_RE = re.compile(r"(\d{1,3}(?:\.\d+)?)\s?%")
+
+
+async def notify(chat_id, text):
+    """app.send_message paced by the shared Telegram rate limiter."""
+    return await throttle.call(app, chat_id, lambda: app.send_message(chat_id, text))
+
+
+class StatusMessage:
+    """One Telegram message kept up to date with a progress bar, edited at most every few seconds."""
+
+    def __init__(self, message: Message, header: str):
+        self.message = message
+        self.header = header
+        self._last_edit = 0.0
+        self._text = message.text
+
+    async def update(self, percent: float):
+        now = time.monotonic()
+        if percent < 100 and now - self._last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+        filled = int(min(percent, 100) // 10)
+        text = f"{self.header}\n{'█' * filled}{'░' * (10 - filled)} {percent:.0f}%"
+        if text == self._text:
+            return
+        self._last_edit = now
+        self._text = text
+        # in the background, so a rate-limited edit never stalls reading the downloader's
+        # output; an edit still held back when the next one comes is replaced by it
+        asyncio.ensure_future(self._edit(text))
+
+    async def _edit(self, text: str):
+        try:
+            await throttle.edit(app, "edit_message_text", self.message.chat.id, self.message.id, text=text)
+        except Exception as e:
+            print(f"Couldn't update status message: {e}")
+
+
+async def run_command(cmd, log_path=None, status: StatusMessage = None):
+    """
+    Run a command in MULTI_DL_PATH without blocking the event loop.
+    Output goes to a ring buffer plus batched log/console writes; progress percentages
+    are forwarded to `status`. Returns (returncode, last LOG_TAIL_LINES lines).
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=MULTI_DL_PATH,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT
+    )
+
+    tail = deque(maxlen=LOG_TAIL_LINES)
+    pending = []
+    last_flush = time.monotonic()
+    log_file = open(log_path, "w", encoding="utf-8") if log_path else None
+
+    def flush():
+        if not pending:
+            return
+        text = "".join(pending)
+        pending.clear()
+        if log_file:
+            log_file.write(text)
+            log_file.flush()
+        print(text, end="")
+
+    try:
+        buffer = ""
+        while chunk := await process.stdout.read(4096):
+            # progress bars redraw with \r, so split on both line endings
+            *lines, buffer = re.split(r"\r\n|\r|\n", buffer + chunk.decode(errors="replace"))
+            percent = None
+            for line in lines:
+                if not line.strip():
+                    continue
+                tail.append(line)
+                pending.append(line + "\n")
+                match = PROGRESS_RE.search(line)
+                if match:
+                    percent = float(match.group(1))
+            if status and percent is not None:
+                await status.update(percent)
+            if time.monotonic() - last_flush >= LOG_FLUSH_INTERVAL:
+                flush()
+                last_flush = time.monotonic()
+        if buffer.strip():
+            tail.append(buffer)
+            pending.append(buffer + "\n")
+    finally:
+        flush()
+        if log_file:
+            log_file.close()
+        if process.returncode is None:
+            # cancelled (/cancel) or failed while reading: don't leave the downloader running
+            process.kill()
+            await process.wait()
+
+    return await process.wait(), tail
+
+
+async def run_mdnx(season_id, episode, dub_lang, dl_subs, default_audio, default_sub, qual, status=None,
+                   log_path=LOG_PATH, file_name=None):
     """
-    Run Multi Downloader NX command for Crunchyroll
+    Run Multi Downloader NX command for Crunchyroll; returns (returncode, last output lines)
     """
     cmd = [
-        "npx", "ts-node", "-T", "./index.ts",
+        *MDNX_CMD,
         "--service", "crunchy",
         "--srz", season_id,
         "-e", episode,
@@ -37,101 +158,240 @@ def run_mdnx(season_id, episode, dub_lang, dl_subs, default_audio, default_sub,
         "--forceMuxer", "mkvmerge",
         "-q", qual
     ]
+    if file_name:
+        cmd += ["--fileName", file_name]
+
+    with span("mdnx_download"):
+        return await run_command(cmd, log_path, status)
+
+# ------------------- Download Queue -------------------
+queue_changed = asyncio.Event()
+login_lock = asyncio.Lock()
+running_jobs = {}  # job id -> asyncio.Task
+cancelled_jobs = set()  # running job ids stopped by /cancel
+download_budget = DiskBudget(VIDEOS_PATH)  # scratch space of the job_<id> folders
+
 
-    with open(LOG_PATH, "w", encoding="utf-8") as log_file:
-        process = subprocess.Popen(
-            cmd,
-            cwd=MULTI_DL_PATH,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1
+async def ensure_session(chat_id):
+    """Auto-login once if MDNX has no session yet (workers share the lock)."""
+    async with login_lock:
+        session_file = os.path.join(MULTI_DL_PATH, "session.json")
+        if os.path.exists(session_file):
+            return
+        await notify(chat_id, "🔑 No session found, auto-login initializing...")
+        login_cmd = [
+            *MDNX_CMD,
+            "--service", "crunchy",
+            "--autoLogin",
+            "--verbose"
+        ]
+        await run_command(login_cmd)
+
+
+def job_output_dir(job_id):
+    """VIDEOS_PATH/job_<id>: the only place a job's downloads can end up."""
+    return os.path.join(VIDEOS_PATH, f"job_{job_id}")
+
+
+def collect_manifest(job_dir):
+    """Video files a job produced, oldest first; only the job's own folder is scanned."""
+    manifest = []
+    for root, _, files in os.walk(job_dir):
+        manifest += [os.path.join(root, f) for f in files if f.endswith(VIDEO_EXTENSIONS)]
+    return sorted(manifest, key=os.path.getmtime)
+
+
+async def process_download(job):
+    """Download one queued episode and upload it to the chat that asked for it."""
+    chat_id, season_id, episode = job["chat_id"], job["season_id"], job["episode"]
+    job_dir = job_output_dir(job["id"])
+    os.makedirs(job_dir, exist_ok=True)
+    log_path = os.path.join(job_dir, "download.log")
+
+    header = f"🎬 #{job['id']}: downloading episode {episode} of season {season_id}..."
+    status = StatusMessage(await notify(chat_id, header), header)
+
+    # ------------------- Ensure Session Initialized -------------------
+    await ensure_session(chat_id)
+
+    # ------------------- Run Downloader -------------------
+    try:
+        returncode, tail = await run_mdnx(
+            season_id, episode, job["dub_lang"], job["dl_subs"], job["default_audio"], job["default_sub"],
+            job["qual"], status, log_path, file_name=f"{os.path.basename(job_dir)}/{MDNX_FILENAME}"
         )
+        if returncode == 0:
+            await notify(chat_id, f"✅ #{job['id']}: download finished successfully!")
+        else:
+            last = "\n".join(line[:300] for line in list(tail)[-FAILURE_TAIL_LINES:])
+            await notify(chat_id, f"❌ #{job['id']}: download failed! Last output:\n\n{last}\n\nFull log below.")
+    except Exception as e:
+        await notify(chat_id, f"⚠️ Error while running downloader:\n{e}")
+
+    # ------------------- Send Log File -------------------
+    try:
+        await throttle.call(app, chat_id, lambda: app.send_document(
+            chat_id, log_path, caption=f"🧾 Download Log #{job['id']}"
+        ))
+    except Exception as e:
+        await notify(chat_id, f"⚠️ Couldn't send log file:\n{e}")
+
+    # ------------------- Upload This Job's Videos -------------------
+    video_files = collect_manifest(job_dir)
+    download_budget.learn(scratch_key(job), dir_size(job_dir))
+    metrics.add_bytes("downloaded", sum(os.path.getsize(f) for f in video_files))
+    if not video_files:
+        await notify(chat_id, "⚠️ No video found to upload.")
+        return
+
+    for video_file in video_files:
+        file_name = os.path.basename(video_file)
+        await notify(chat_id, f"📤 Uploading `{file_name}` to Telegram...")
+
+        try:
+            key = "file:" + await asyncio.to_thread(file_fingerprint, video_file)
+            with span("upload"):
+                await upload_pool.send_cached("send_document", chat_id, key, video_file, caption=f"🎥 {file_name}")
+            await notify(chat_id, "✅ Upload complete!")
+        except Exception as e:
+            await notify(chat_id, f"⚠️ Upload failed:\n{e}")
+
+
+def scratch_key(job):
+    """Episodes of one season in one quality come out about the same size."""
+    return f"{job['season_id']}:{job['qual']}"
 
-        for line in process.stdout:
-            log_file.write(line)
-            log_file.flush()
-            print(line, end="")
 
-        process.wait()
+async def profiled_download(job):
+    # waits here while the disk can't take another episode
+    async with download_budget.reserve_for(job_output_dir(job["id"]), download_budget.estimate(scratch_key(job)),
+                                           f"Download #{job['id']}"):
+        with span("job"), profile_job(f"dl_{job['id']}"):
+            await process_download(job)
+
+
+async def download_worker():
+    while True:
+        queue_changed.clear()
+        job = download_queue.claim_next()
+        if job is None:
+            await queue_changed.wait()
+            continue
+
+        task = asyncio.ensure_future(profiled_download(job))
+        running_jobs[job["id"]] = task
+        try:
+            await task
+            download_queue.finish(job["id"], "done")
+        except asyncio.CancelledError:
+            if job["id"] not in cancelled_jobs:
+                raise  # shutting down: stays 'running' and is re-queued on restart
+            cancelled_jobs.discard(job["id"])
+            await notify(job["chat_id"], f"🛑 #{job['id']} cancelled.")
+        except Exception as e:
+            download_queue.finish(job["id"], "failed")
+            print(f"Download #{job['id']} failed: {e!r}")
+        finally:
+            running_jobs.pop(job["id"], None)
+            shutil.rmtree(job_output_dir(job["id"]), ignore_errors=True)
 
-    return process.returncode
 
 # ------------------- Bot Commands -------------------
 @app.on_message(filters.command("dl") & filters.private)
 async def download_crunchyroll(client: Client, message: Message):
     """
-    Download a Crunchyroll episode using Multi Downloader NX
+    Queue Crunchyroll episodes for download using Multi Downloader NX
     Command format:
-    /dl <season_id> <episode> <dubLang> <subs> <defaultAudio> <defaultSub> <quality>
+    /dl <season_id> <episodes> <dubLang> <subs> <defaultAudio> <defaultSub> <quality>
+    <episodes> is a number, range or list, e.g. 5, 1-12 or 1-12,15
     """
     cmd_args = message.text.split()
     if len(cmd_args) < 8:
         await message.reply_text(
-            "Usage:\n/dl <season_id> <episode> <dubLang> <subs> <defaultAudio> <defaultSub> <quality>"
+            "Usage:\n/dl <season_id> <episodes> <dubLang> <subs> <defaultAudio> <defaultSub> <quality>\n"
+            "Episodes: 5, 1-12 or 1-12,15"
         )
         return
 
-    season_id, episode, dub_lang, dl_subs, default_audio, default_sub, qual = cmd_args[1:8]
+    season_id, episode_spec, dub_lang, dl_subs, default_audio, default_sub, qual = cmd_args[1:8]
+    try:
+        episodes = download_queue.parse_episodes(episode_spec)
+    except ValueError as e:
+        await message.reply_text(f"⚠️ Invalid episodes `{episode_spec}`: {e}")
+        return
 
-    await message.reply_text(f"🎬 Starting download for episode {episode} of season {season_id}...")
+    ids = download_queue.enqueue(
+        message.from_user.id, message.chat.id, season_id, episodes,
+        dub_lang, dl_subs, default_audio, default_sub, qual
+    )
+    queue_changed.set()
+    await message.reply_text(
+        f"📥 Queued {len(ids)} episode(s) of season {season_id}: #{ids[0]}" + (f"–#{ids[-1]}" if len(ids) > 1 else "")
+    )
 
-    # ------------------- Ensure Session Initialized -------------------
-    session_file = os.path.join(MULTI_DL_PATH, "session.json")
-    if not os.path.exists(session_file):
-        await message.reply_text("🔑 No session found, auto-login initializing...")
-        login_cmd = [
-            "npx", "ts-node", "-T", "./index.ts",
-            "--service", "crunchy",
-            "--autoLogin",
-            "--verbose"
-        ]
-        subprocess.run(login_cmd, cwd=MULTI_DL_PATH)
 
-    # ------------------- Run Downloader -------------------
-    try:
-        returncode = run_mdnx(season_id, episode, dub_lang, dl_subs, default_audio, default_sub, qual)
-        if returncode == 0:
-            await message.reply_text("✅ Download finished successfully!")
-        else:
-            await message.reply_text("❌ Download failed! Check the log for details.")
-    except Exception as e:
-        await message.reply_text(f"⚠️ Error while running downloader:\n{e}")
+@app.on_message(filters.command("queue") & filters.private)
+async def show_queue(client: Client, message: Message):
+    jobs = download_queue.list_jobs()
+    mine = [j for j in jobs if j["user_id"] == message.from_user.id]
+    if not mine:
+        await message.reply_text(f"📭 Nothing queued for you ({len(jobs)} job(s) in the queue overall).")
+        return
 
-    # ------------------- Send Log File -------------------
-    try:
-        await message.reply_document(LOG_PATH, caption="🧾 Download Log")
-    except Exception as e:
-        await message.reply_text(f"⚠️ Couldn't send log file:\n{e}")
+    lines = [
+        f"{'⬇️' if j['status'] == 'running' else '⏳'} #{j['id']} season {j['season_id']} ep {j['episode']} [{j['qual']}]"
+        for j in mine
+    ]
+    await message.reply_text(f"📋 Your downloads ({len(jobs)} overall):\n" + "\n".join(lines))
 
-    # ------------------- Find Downloaded Video -------------------
-    video_files = glob.glob(os.path.join(VIDEOS_PATH, "**/*.mkv"), recursive=True)
-    video_files += glob.glob(os.path.join(VIDEOS_PATH, "**/*.mp4"), recursive=True)
 
-    if not video_files:
-        await message.reply_text("⚠️ No video found to upload.")
-        return
+@app.on_message(filters.command("stats") & filters.private)
+async def show_stats(client: Client, message: Message):
+    """Stage timings, byte counters and queue depths since start."""
+    await message.reply_text(metrics.format_stats())
 
-    # Pick the newest file
-    video_file = max(video_files, key=os.path.getmtime)
-    file_name = os.path.basename(video_file)
 
-    await message.reply_text(f"📤 Uploading `{file_name}` to Telegram...")
+@app.on_message(filters.command("cancel") & filters.private)
+async def cancel_download(client: Client, message: Message):
+    """
+    /cancel <id>  – cancel one of your downloads
+    /cancel all   – cancel all of them
+    """
+    args = message.text.split()
+    if len(args) < 2 or (args[1] != "all" and not args[1].lstrip("#").isdigit()):
+        await message.reply_text("Usage:\n/cancel <id>\n/cancel all")
+        return
 
-    try:
-        await message.reply_document(video_file, caption=f"🎥 {file_name}")
-        await message.reply_text("✅ Upload complete!")
-    except Exception as e:
-        await message.reply_text(f"⚠️ Upload failed:\n{e}")
+    job_id = None if args[1] == "all" else int(args[1].lstrip("#"))
+    cancelled, running = download_queue.cancel(message.from_user.id, job_id)
+    for running_id in running:
+        task = running_jobs.get(running_id)
+        if task:
+            cancelled_jobs.add(running_id)
+            task.cancel()
 
-    # Optional cleanup
-    try:
-        os.remove(video_file)
-    except Exception:
-        pass
+    if not cancelled:
+        await message.reply_text("Nothing to cancel.")
+    else:
+        await message.reply_text("🛑 Cancelled " + ", ".join(f"#{i}" for i in cancelled))
 
 
 # ------------------- Run Bot -------------------
+async def main():
+    async with app:
+        await upload_pool.start()
+        await start_metrics_server()
+        metrics.gauge("downloads_queued", lambda: sum(j["status"] == "queued" for j in download_queue.list_jobs()))
+        metrics.gauge("downloads_running", lambda: len(running_jobs))
+        workers = [asyncio.ensure_future(download_worker()) for _ in range(DL_WORKERS)]
+        workers.append(asyncio.ensure_future(sweep_loop(download_budget, prefix="job_")))
+        print("🤖 Crunchyroll Bot Started...")
+        await idle()
+        for worker in workers:
+            worker.cancel()
+        await upload_pool.stop()
+        await close_session()
+
+
 if __name__ == "__main__":
-    print("🤖 Crunchyroll Bot Started...")
-    app.run()
+    app.run(main())
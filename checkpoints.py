@@ -0,0 +1,84 @@
+import os
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+from details import get_checkpoints, save_checkpoint
+from pipeline import Workspace
+from uploader import file_fingerprint
+
+
+class EpisodeCheckpoint:
+    """Finished stages of one episode job, kept in the details store.
+
+    Downloads are recorded with a size + fingerprint per file, merges with the
+    output size, uploads with the message they produced. A rerun of the same
+    episode (same deterministic workspace) skips whatever is still intact.
+    """
+
+    def __init__(self, title: str, episode: int, workspace: Workspace):
+        self.title = title
+        self.episode = episode
+        self.workspace = workspace
+
+    def _get(self, stage: str) -> Dict[str, dict]:
+        return get_checkpoints(self.title, self.episode, stage)
+
+    def _save(self, stage: str, name: str, value: dict):
+        save_checkpoint(self.title, self.episode, stage, name, value)
+
+    # ---- downloads ---- #
+    async def _snapshot(self, directory: str) -> Dict[str, dict]:
+        paths = [os.path.join(directory, f) for f in sorted(os.listdir(directory))]
+        paths = [p for p in paths if os.path.isfile(p)]
+        fingerprints = await asyncio.gather(*(asyncio.to_thread(file_fingerprint, p) for p in paths))
+        return {
+            os.path.relpath(p, self.workspace.root): {"size": os.path.getsize(p), "fingerprint": fp}
+            for p, fp in zip(paths, fingerprints)
+        }
+
+    async def _intact(self, files: Dict[str, dict]) -> bool:
+        # a video deleted after its quality was uploaded is no longer needed
+        uploaded = {u["source"] for u in self.uploads().values()}
+        for name, recorded in files.items():
+            if name in uploaded:
+                continue
+            path = os.path.join(self.workspace.root, name)
+            if not os.path.isfile(path) or os.path.getsize(path) != recorded["size"]:
+                return False
+            if await asyncio.to_thread(file_fingerprint, path) != recorded["fingerprint"]:
+                return False
+        return bool(files)
+
+    async def download(self, name: str, directory: str, run: Callable[[], Awaitable[object]]) -> bool:
+        """await run() unless an earlier run's files in `directory` are still intact; True if it ran."""
+        recorded = self._get("download").get(name)
+        if recorded is not None and await self._intact(recorded["files"]):
+            print(f"♻️ Reusing {name} download of {self.title} Ep {self.episode}")
+            return False
+        await run()
+        files = await self._snapshot(directory)
+        if files:
+            self._save("download", name, {"files": files})
+        return True
+
+    # ---- merges ---- #
+    def merged(self, res: str, path: str) -> bool:
+        recorded = self._get("merge").get(res)
+        return recorded is not None and os.path.isfile(path) and os.path.getsize(path) == recorded["size"]
+
+    def mark_merged(self, res: str, path: str):
+        self._save("merge", res, {"path": os.path.relpath(path, self.workspace.root), "size": os.path.getsize(path)})
+
+    # ---- uploads ---- #
+    def uploads(self) -> Dict[str, dict]:
+        return self._get("upload")
+
+    def uploaded(self, res: str) -> Optional[dict]:
+        return self.uploads().get(res)
+
+    def mark_uploaded(self, res: str, source: str, message=None):
+        self._save("upload", res, {
+            "source": os.path.relpath(source, self.workspace.root),
+            "chat_id": message.chat.id if message else None,
+            "message_id": message.id if message else None,
+        })
@@ -0,0 +1,300 @@
+"""
+Shared core of the scheduled uploaders (mpro.py and new.py): config, the episode
+job queue, the download/probe/merge steps of an episode, the weekly schedule,
+backfill and the bot commands. Each script keeps only how it uploads and posts.
+
+Anything a restarted bot doesn't need to answer its first message (APScheduler,
+pytz) is imported on first use.
+"""
+import os
+import re
+import asyncio
+import importlib
+from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from pyrogram import Client
+from data import close_session
+from details import episode_done, get_details, unfinished_jobs
+from media import can_stream, fill_missing_qualities, merge_video_audio, probe_videos
+from metrics import metrics, start_metrics_server
+from pipeline import (
+    MAX_JOBS, MAX_MERGED_ON_DISK, JobScheduler, Workspace, dir_size, discard_scratch, disk_budget, fetch,
+    gather_or_fail, sweep_loop, workspace_root
+)
+from uploader import UploadPool, remux_cache_key
+
+# ---------------- CONFIG ---------------- #
+API_ID = int(os.environ.get("API_ID", 123456))
+API_HASH = os.environ.get("API_HASH", "your_api_hash")
+BOT_TOKEN = os.environ.get("BOT_TOKEN", "your_bot_token")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))   # downloader scripts live here
+STREAM_UPLOAD = os.environ.get("STREAM_UPLOAD") == "1"   # pipe ffmpeg into the upload, no merged file
+TIMEZONE_NAME = "Asia/Kolkata"
+ADMIN_IDS = {int(i) for i in os.environ.get("ADMIN_IDS", "").split(",") if i}   # may use /backfill
+
+# downloader commands per show; every run adds --episode N (the weekly one the counter's episode)
+SHOWS = {
+    "Solo Leveling": (
+        f"python {BASE_DIR}/animepahe_dl.py --anime solo-leveling",
+        f"python {BASE_DIR}/crunchy_audio_dl.py --anime solo-leveling",
+    ),
+    "Naruto": (
+        f"python {BASE_DIR}/nx_downloader.py --anime naruto",
+        f"python {BASE_DIR}/crunchy_audio_dl.py --anime naruto",
+    ),
+}
+# (title, day_of_week, hour, minute) of each weekly run
+WEEKLY = [
+    ("Solo Leveling", "wed", 9, 0),
+    ("Naruto", "wed", 22, 0),
+]
+BACKFILL_PRIORITY = 1   # behind resumed jobs (-1) and the weekly episodes (0)
+
+# a script's process_anime(title, video_cmd, audio_cmd, episode=None)
+ProcessAnime = Callable[..., Awaitable[None]]
+
+job_queue = JobScheduler()
+running_episodes: Set[Tuple[str, int]] = set()
+
+
+@lru_cache(maxsize=None)
+def timezone():
+    import pytz
+    return pytz.timezone(TIMEZONE_NAME)
+
+
+async def import_in_background(name: str):
+    """Import `name` on a worker thread, so the event loop keeps handling updates meanwhile."""
+    return await asyncio.to_thread(importlib.import_module, name)
+
+
+def create_bot(name: str) -> Tuple[Client, UploadPool]:
+    bot = Client(name, api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
+    return bot, UploadPool.from_env(bot, API_ID, API_HASH)   # + UPLOAD_BOT_TOKENS helpers
+
+
+# ---------------- EPISODE ---------------- #
+async def run_episode(process_episode: Callable[..., Awaitable[None]], title: str, video_cmd: str, audio_cmd: str,
+                      episode: Optional[int] = None):
+    """Run process_episode(title, season, episode, video_cmd, audio_cmd) for `episode`
+    (default: the show's next one) unless that episode is already running or finished.
+
+    The episode starts once there is scratch space for it; if it fails, the
+    merged and half-written files it leaves behind are removed.
+    """
+    info = get_details(title)
+    if episode is None:
+        episode = info["episode"]
+    if (title, episode) in running_episodes:
+        print(f"{title} Ep {episode} is already being processed")
+        return
+    # checked here, not only when queued: a second backfill or the weekly run may have finished it since
+    if episode_done(title, episode):
+        print(f"{title} Ep {episode} is already done")
+        return
+    running_episodes.add((title, episode))
+    root = workspace_root(title, info["season"], episode)
+    try:
+        async with disk_budget.reserve_for(root, disk_budget.estimate(title), f"{title} Ep {episode}"):
+            await process_episode(title, info["season"], episode, video_cmd, audio_cmd)
+    except BaseException:
+        await asyncio.to_thread(discard_scratch, root)
+        raise
+    finally:
+        running_episodes.discard((title, episode))
+
+
+async def download_episode(checkpoint, workspace: Workspace, video_cmd: str, audio_cmd: str):
+    """Run both downloaders together; one failing cancels the other and fails the job."""
+    async def download_videos():
+        print("Downloading anime videos...")
+        await fetch(video_cmd, workspace, workspace.downloads)
+
+    async def download_audio():
+        print("Downloading Crunchyroll audio...")
+        await fetch(audio_cmd, workspace, workspace.audio)
+
+    await gather_or_fail(
+        checkpoint.download("video", workspace.downloads, download_videos),
+        checkpoint.download("audio", workspace.audio, download_audio),
+    )
+    metrics.add_bytes("downloaded", dir_size(workspace.downloads) + dir_size(workspace.audio))
+
+
+async def prepare_episode(title: str, season: int, episode: int, workspace: Workspace, checkpoint,
+                          target_heights: List[int]) -> Optional[Tuple[str, List[tuple]]]:
+    """Pick the audio track and up to 3 videos; returns (audio_file, jobs) or None if an input is missing.
+
+    Each job is (res, video, merged_file, streamed, cache_key, probed).
+    """
+    audio_files = [
+        os.path.join(workspace.audio, f) for f in os.listdir(workspace.audio) if f.endswith((".m4a", ".aac", ".mp3"))
+    ]
+    if not audio_files:
+        print("❌ No audio file found.")
+        return None
+    audio_file = audio_files[0]
+
+    # lowest 3 resolutions, labelled by their real height
+    videos = await probe_videos(workspace.downloads, (".mp4",))
+    # qualities uploaded before an interruption are not made again
+    wanted = [h for h in target_heights if f"{h}p" not in checkpoint.uploads()]
+    reserve_scratch(title, workspace, videos, audio_file, len(wanted))
+    videos = (await fill_missing_qualities(videos, wanted, workspace.downloads))[:3]
+    if not videos and not checkpoint.uploads():
+        print("❌ No video files found.")
+        return None
+
+    jobs = []
+    for idx, probed in enumerate(videos):
+        vid = probed.path
+        res = probed.label or f"{target_heights[min(idx, len(target_heights) - 1)]}p"
+        merged_file = os.path.join(workspace.merged, f"{title}_S{season:02d}E{episode:02d}_{res}.mp4")
+        streamed = STREAM_UPLOAD and await can_stream(vid, audio_file)
+        cache_key = await remux_cache_key(vid, audio_file)
+        jobs.append((res, vid, merged_file, streamed, cache_key, probed))
+    return audio_file, jobs
+
+
+def reserve_scratch(title: str, workspace: Workspace, videos: list, audio_file: str, wanted: int):
+    """Swap the episode's guessed scratch reservation for one worked out from what was downloaded:
+    the downloads, a transcode per missing quality and the merged copies run_pipeline keeps."""
+    largest = max((os.path.getsize(probed.path) for probed in videos), default=0)
+    renditions = max(0, min(wanted, 3) - len(videos)) * largest
+    merged = 0 if STREAM_UPLOAD else min(MAX_MERGED_ON_DISK, wanted) * (largest + os.path.getsize(audio_file))
+    used = dir_size(workspace.downloads) + dir_size(workspace.audio)
+    disk_budget.resize(workspace.root, used + renditions + merged, key=title)
+
+
+def merge_step(upload_pool: UploadPool, checkpoint, title: str, episode: int, audio_file: str):
+    """The merge half of run_pipeline() for the jobs from prepare_episode()."""
+    async def merge(job):
+        res, vid, merged_file, streamed, cache_key, probed = job
+        if streamed or upload_pool.is_cached(cache_key):
+            return  # remuxed on the fly, or re-sent by file_id, in the upload stage
+        if checkpoint.uploaded(res) or checkpoint.merged(res, merged_file):
+            return
+        print(f"Merging {res} for {title} Ep {episode}...")
+        elapsed = await merge_video_audio(vid, audio_file, merged_file)
+        checkpoint.mark_merged(res, merged_file)
+        print(f"Merged {res} in {elapsed:.1f}s")
+
+    return merge
+
+
+# ---------------- SCHEDULE ---------------- #
+async def schedule_jobs(process_anime: ProcessAnime):
+    scheduler_module = await import_in_background("apscheduler.schedulers.asyncio")
+    scheduler = scheduler_module.AsyncIOScheduler(timezone=timezone())
+    job_queue.start()
+
+    # episodes interrupted by a crash or restart resume first
+    for job in unfinished_jobs():
+        # rows written before jobs were pinned may hold a --latest command
+        commands = episode_commands(job["title"], job["episode"]) if job["title"] in SHOWS else (
+            job["video_cmd"], job["audio_cmd"]
+        )
+        await job_queue.submit(
+            f"{job['title']} Ep {job['episode']}",
+            lambda job=job, commands=commands: process_anime(job["title"], *commands, job["episode"]),
+            priority=-1
+        )
+
+    for title, day, hour, minute in WEEKLY:
+        scheduler.add_job(
+            job_queue.submit,
+            args=[title, lambda title=title: weekly_episode(process_anime, title)],
+            trigger="cron", day_of_week=day, hour=hour, minute=minute
+        )
+
+    scheduler.start()
+    print(f"✅ Scheduler started ({TIMEZONE_NAME})")
+    while True:
+        await asyncio.sleep(60)
+
+
+def episode_commands(title: str, episode: int) -> Tuple[str, str]:
+    """The show's downloader commands pinned to `episode`."""
+    video_cmd, audio_cmd = SHOWS[title]
+    return f"{video_cmd} --episode {episode}", f"{audio_cmd} --episode {episode}"
+
+
+async def weekly_episode(process_anime: ProcessAnime, title: str):
+    """The weekly run: the episode the counter is at, by number, so a counter still
+    catching up never gets the newest episode posted under its own number."""
+    episode = get_details(title)["episode"]
+    await process_anime(title, *episode_commands(title, episode), episode)
+
+
+def resumable_workspaces() -> List[str]:
+    """Workspaces of the jobs schedule_jobs() resumes after a restart."""
+    return [
+        workspace_root(job["title"], get_details(job["title"])["season"], job["episode"]) for job in unfinished_jobs()
+    ]
+
+
+def schedule_text() -> str:
+    return "\n".join(f"🕘 {title} - {day.title()} {hour:02d}:{minute:02d}" for title, day, hour, minute in WEEKLY)
+
+
+# ---------------- BACKFILL ---------------- #
+async def backfill(process_anime: ProcessAnime, title: str, first: int, last: int) -> int:
+    """Queue episodes first..last of `title` that aren't finished yet; returns how many were queued."""
+    queued = 0
+    for episode in range(first, last + 1):
+        if episode_done(title, episode):
+            continue
+        await job_queue.submit(f"{title} Ep {episode}", lambda episode=episode: process_anime(
+            title, *episode_commands(title, episode), episode
+        ), priority=BACKFILL_PRIORITY)
+        queued += 1
+    return queued
+
+
+def parse_backfill(text: str) -> Optional[Tuple[str, int, int]]:
+    """'/backfill Naruto 188-220' -> ("Naruto", 188, 220)"""
+    match = re.fullmatch(r"/backfill\s+(.+?)\s+(\d+)(?:-(\d+))?", text.strip())
+    if not match or match[1] not in SHOWS:
+        return None
+    first = int(match[2])
+    return match[1], first, int(match[3] or first)
+
+
+# ---------------- BOT ---------------- #
+def register_commands(bot: Client, process_anime: ProcessAnime, greeting: str):
+    """/start, /stats and /backfill; returns the handler."""
+    @bot.on_message()
+    async def command_handler(_, message):
+        text = message.text or ""
+        if text == "/start":
+            await message.reply(f"{greeting}\n\n{schedule_text()}")
+        elif text == "/stats":
+            await message.reply(metrics.format_stats())
+        elif text.startswith("/backfill"):
+            if not message.from_user or message.from_user.id not in ADMIN_IDS:
+                return
+            parsed = parse_backfill(text)
+            if not parsed:
+                await message.reply(f"Usage: /backfill <title> <first>-<last>\nShows: {', '.join(SHOWS)}")
+                return
+            title, first, last = parsed
+            queued = await backfill(process_anime, title, first, last)
+            await message.reply(f"Queued {queued} episode(s) of {title} ({first}-{last}), {MAX_JOBS} at a time")
+
+    return command_handler
+
+
+async def serve(bot: Client, upload_pool: UploadPool, process_anime: ProcessAnime):
+    async with bot:
+        await upload_pool.start()
+        await start_metrics_server()
+        # workspaces a crash left behind, except the ones a restart resumes
+        sweeper = asyncio.ensure_future(sweep_loop(disk_budget, resumable=resumable_workspaces))
+        try:
+            await schedule_jobs(process_anime)
+        finally:
+            sweeper.cancel()
+            await upload_pool.stop()
+            await close_session()   # AniList/poster HTTP pool
@@ -1,78 +1,564 @@
 import os
 import re
-import aiohttp
-import anitopy
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import unicodedata
 from io import BytesIO
-from PIL import Image
-from datetime import datetime
-from typing import Optional, Tuple
-from pyrogram.types import InputMediaPhoto
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, NamedTuple, Optional, Set, Tuple
+from metrics import metrics, span
 
 # ──────────────── AniList GraphQL Query ──────────────── #
+ANIME_MEDIA_FRAGMENT = """
+fragment media on Media {
+  id
+  title {
+    english
+    romaji
+    native
+  }
+  synonyms
+  description
+  episodes
+  genres
+  seasonYear
+  coverImage {
+    extraLarge
+    large
+    medium
+    color
+  }
+}
+"""
+
 ANIME_GRAPHQL_QUERY = """
 query ($search: String, $seasonYear: Int) {
   Media(search: $search, seasonYear: $seasonYear, type: ANIME) {
-    id
-    title {
-      english
-      romaji
-      native
-    }
-    description
-    episodes
-    genres
-    seasonYear
-    coverImage {
-      extraLarge
-      large
-      medium
-      color
-    }
+    ...media
   }
 }
-"""
+""" + ANIME_MEDIA_FRAGMENT
+
+
+def build_batch_query(count: int) -> str:
+    """Aliased document resolving `count` titles or IDs at once (m0 … m{count-1})."""
+    params = ", ".join(f"$i{i}: Int, $s{i}: String, $y{i}: Int" for i in range(count))
+    fields = "\n".join(
+        f"  m{i}: Media(id: $i{i}, search: $s{i}, seasonYear: $y{i}, type: ANIME) {{ ...media }}" for i in range(count)
+    )
+    return f"query ({params}) {{\n{fields}\n}}\n" + ANIME_MEDIA_FRAGMENT
+
+# ──────────────── Config ──────────────── #
+ANILIST_URL = os.environ.get("ANILIST_URL", "https://graphql.anilist.co")
+ANILIST_CACHE_PATH = os.environ.get("ANILIST_CACHE_PATH", "anilist_cache.db")
+ANILIST_CACHE_TTL = int(os.environ.get("ANILIST_CACHE_TTL", 7 * 24 * 3600))      # found shows
+ANILIST_NEGATIVE_TTL = int(os.environ.get("ANILIST_NEGATIVE_TTL", 6 * 3600))     # "not found" answers
+ANILIST_CACHE_SIZE = int(os.environ.get("ANILIST_CACHE_SIZE", 512))              # in-memory entries
+ANILIST_BATCH_WINDOW = float(os.environ.get("ANILIST_BATCH_WINDOW", 0.25))      # seconds to collect lookups
+ANILIST_BATCH_SIZE = int(os.environ.get("ANILIST_BATCH_SIZE", 10))               # titles per request
+ANILIST_RATE_LIMIT = int(os.environ.get("ANILIST_RATE_LIMIT", 90))               # requests per minute
+ANILIST_MAX_RETRIES = 3
+THUMB_CACHE_DIR = os.environ.get("THUMB_CACHE_DIR", "thumb_cache")
+THUMB_WORKERS = int(os.environ.get("THUMB_WORKERS", 2))                          # decode/encode threads
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 20))
+TITLE_MATCH_THRESHOLD = float(os.environ.get("TITLE_MATCH_THRESHOLD", 0.85))   # trigram similarity, 0-1
+TITLE_MATCH_CACHE_SIZE = 4096
+HTTP_TIMEOUT = 30                                                                # seconds per request
+
+
+# ──────────────── Shared HTTP Session ──────────────── #
+# aiohttp, anitopy and PIL are imported on first use, so importing this module stays cheap
+_session: Optional["aiohttp.ClientSession"] = None
+
+async def get_session() -> "aiohttp.ClientSession":
+    """Return the module-wide pooled session, creating it on first use."""
+    global _session
+    if _session is None or _session.closed:
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+    return _session
+
+async def close_session():
+    """Close the pooled session (call once on shutdown)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+# ──────────────── AniList Cache ──────────────── #
+def normalize_title(title: str) -> str:
+    """Casefolded, width-folded, punctuation-free and single-spaced."""
+    title = unicodedata.normalize("NFKC", title).casefold()
+    return " ".join(re.sub(r"[\W_]+", " ", title).split())
+
+
+class AniListCache:
+    """In-memory LRU in front of a SQLite store of AniList `Media` responses.
+
+    An empty dict is a cached "not found" and lives for `negative_ttl` seconds.
+    """
+
+    def __init__(self, path: str, maxsize: int, ttl: int, negative_ttl: int):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+
+    @staticmethod
+    def make_key(search: str, year: Optional[int]) -> str:
+        return f"{normalize_title(search)}|{year or ''}"
+
+    @staticmethod
+    def id_key(media_id: int) -> str:
+        return f"id:{media_id}"
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS media (key TEXT PRIMARY KEY, expires REAL, body TEXT)"
+            )
+        return self._db
+
+    def _remember(self, key: str, entry: Tuple[float, dict]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached media, {} for a cached miss, or None if unknown/expired."""
+        entry = self._memory.get(key)
+        if entry is None:
+            row = self._conn().execute("SELECT expires, body FROM media WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            entry = (row[0], json.loads(row[1]))
+        if entry[0] < time.time():
+            self._memory.pop(key, None)
+            with self._conn() as db:
+                db.execute("DELETE FROM media WHERE key = ?", (key,))
+            return None
+        self._remember(key, entry)
+        return entry[1]
+
+    def set(self, key: str, media: dict):
+        expires = time.time() + (self.ttl if media else self.negative_ttl)
+        self._remember(key, (expires, media))
+        with self._conn() as db:
+            db.execute("INSERT OR REPLACE INTO media VALUES (?, ?, ?)", (key, expires, json.dumps(media)))
+
+
+anilist_cache = AniListCache(ANILIST_CACHE_PATH, ANILIST_CACHE_SIZE, ANILIST_CACHE_TTL, ANILIST_NEGATIVE_TTL)
+
+
+# ──────────────── Title Index ──────────────── #
+def _trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """Normalized title variants → AniList ID, kept in SQLite and matched in memory.
+
+    Variants (english/romaji/native/synonyms and the searches that found them)
+    are learned from successful lookups or bulk-imported. An exact variant is a
+    dict hit; anything else is scored by trigram similarity, and titles with
+    different numbers ("Season 2" / "Season 3") never match each other.
+    """
+
+    def __init__(self, path: str, threshold: float):
+        self.path = path
+        self.threshold = threshold
+        self._db: Optional[sqlite3.Connection] = None
+        self._variants: Optional[Dict[str, Tuple[int, Optional[int]]]] = None   # variant -> (id, year)
+        self._postings: Dict[str, Set[str]] = {}                                 # trigram -> variants
+        self._sizes: Dict[str, int] = {}                                         # variant -> trigram count
+        self._matches: Dict[Tuple[str, Optional[int]], Optional[int]] = {}
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS titles (variant TEXT PRIMARY KEY, media_id INTEGER, year INTEGER)"
+            )
+        return self._db
+
+    def _load(self) -> Dict[str, Tuple[int, Optional[int]]]:
+        if self._variants is None:
+            self._variants = {}
+            for variant, media_id, year in self._conn().execute("SELECT variant, media_id, year FROM titles"):
+                self._insert(variant, media_id, year)
+        return self._variants
+
+    def _insert(self, variant: str, media_id: int, year: Optional[int]):
+        self._variants[variant] = (media_id, year)
+        grams = _trigrams(variant)
+        self._sizes[variant] = len(grams)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(variant)
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def add(self, media_id: int, titles: Iterable[Optional[str]], year: Optional[int] = None) -> int:
+        """Map every title in `titles` to `media_id`; returns how many variants were new or changed."""
+        variants = self._load()
+        rows = []
+        for title in titles:
+            variant = normalize_title(title or "")
+            if variant and variants.get(variant) != (media_id, year):
+                self._insert(variant, media_id, year)
+                rows.append((variant, media_id, year))
+        if rows:
+            self._matches.clear()
+            with self._conn() as db:
+                db.executemany("INSERT OR REPLACE INTO titles VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def learn(self, media: dict, *searches: str) -> int:
+        """Index an AniList `Media` under all its titles plus the searches that resolved to it."""
+        titles = media.get("title") or {}
+        return self.add(
+            media["id"],
+            [titles.get("english"), titles.get("romaji"), titles.get("native"), *(media.get("synonyms") or []), *searches],
+            media.get("seasonYear"),
+        )
+
+    def match(self, title: str, year: Optional[int] = None) -> Optional[int]:
+        """AniList ID of the closest known variant of `title`, or None below the threshold."""
+        variants = self._load()
+        query = normalize_title(title)
+        key = (query, year)
+        if key not in self._matches:
+            if len(self._matches) >= TITLE_MATCH_CACHE_SIZE:
+                self._matches.clear()
+            self._matches[key] = self._best(variants, query, year)
+        return self._matches[key]
+
+    def _best(self, variants: Dict[str, Tuple[int, Optional[int]]], query: str, year: Optional[int]) -> Optional[int]:
+        exact = variants.get(query)
+        if exact and (year is None or exact[1] in (None, year)):
+            return exact[0]
+
+        grams = _trigrams(query)
+        shared = Counter(v for gram in grams for v in self._postings.get(gram, ()))
+        numbers = re.findall(r"\d+", query)
+        best, best_score = None, self.threshold
+        for variant, overlap in shared.items():
+            score = 2 * overlap / (len(grams) + self._sizes[variant])   # Sørensen–Dice
+            if score < best_score:
+                continue
+            media_id, variant_year = variants[variant]
+            if re.findall(r"\d+", variant) != numbers or (year and variant_year not in (None, year)):
+                continue
+            best, best_score = media_id, score
+        return best
+
+    def import_file(self, path: str) -> int:
+        """Bulk-load a JSON list (or JSON lines) of AniList `Media` objects or
+        anime-offline-database entries; returns how many variants were added."""
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        try:
+            entries = json.loads(text)
+        except json.JSONDecodeError:
+            entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+        if isinstance(entries, dict):
+            entries = entries.get("data", [])   # anime-offline-database wraps its list
+
+        added = 0
+        for entry in entries:
+            if "id" in entry and "title" in entry:
+                added += self.learn(entry)
+                continue
+            anilist = [m for m in (re.search(r"anilist\.co/anime/(\d+)", s) for s in entry.get("sources", [])) if m]
+            if anilist:
+                year = (entry.get("animeSeason") or {}).get("year")
+                added += self.add(int(anilist[0][1]), [entry.get("title"), *entry.get("synonyms", [])], year)
+        return added
+
+
+title_index = TitleIndex(ANILIST_CACHE_PATH, TITLE_MATCH_THRESHOLD)
+
+
+# ──────────────── Rate Limiter ──────────────── #
+class RateLimiter:
+    """Token bucket kept in step with AniList's X-RateLimit-* and Retry-After headers."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * 60 / self.capacity)
+
+    def update(self, status: int, headers) -> float:
+        """Sync the bucket with a response; returns the back-off (seconds) for a 429."""
+        self._refill(time.monotonic())
+        limit = headers.get("X-RateLimit-Limit")
+        remaining = headers.get("X-RateLimit-Remaining")
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+        if status != 429:
+            return 0.0
+        wait = float(headers.get("Retry-After") or 60)
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + wait)
+        return wait
+
+
+# ──────────────── Batched Lookups ──────────────── #
+class AniListBatcher:
+    """Collects lookups for a short window and resolves them with one aliased query."""
+
+    def __init__(self, window: float, max_batch: int, limiter: RateLimiter):
+        self.window = window
+        self.max_batch = max_batch
+        self.limiter = limiter
+        self._pending: Dict[str, Tuple[Optional[str], Optional[int], Optional[int], asyncio.Future]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def lookup(self, search: Optional[str], year: Optional[int], media_id: Optional[int] = None) -> dict:
+        """Resolve a search (optionally pinned to `year`), or a known `media_id`."""
+        key = anilist_cache.id_key(media_id) if media_id else anilist_cache.make_key(search, year)
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[key] = (search, year, media_id, future)
+        self._inflight[key] = future
+        if len(self._pending) >= self.max_batch:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._schedule_flush)
+        return await asyncio.shield(future)
+
+    def _schedule_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            asyncio.ensure_future(self._flush(batch))
+
+    async def _flush(self, batch: Dict[str, Tuple[Optional[str], Optional[int], Optional[int], asyncio.Future]]):
+        keys = list(batch)
+        variables = {}
+        for i, key in enumerate(keys):
+            search, year, media_id = batch[key][:3]
+            # AniList ANDs the arguments, so a known ID goes alone: the raw (maybe misspelled)
+            # search would turn the index's fuzzy matches into Not Found
+            if media_id:
+                variables[f"i{i}"] = media_id
+            else:
+                variables[f"s{i}"], variables[f"y{i}"] = search, year
+
+        try:
+            data, status = await self._post(build_batch_query(len(keys)), variables)
+        except Exception as e:
+            for key in keys:
+                self._inflight.pop(key, None).set_exception(e)
+            return
+
+        results = data.get("data") or {}
+        for i, key in enumerate(keys):
+            media = results.get(f"m{i}") or {}
+            # a missing alias alongside a usable response means AniList had no match
+            if status in (200, 404) or results:
+                anilist_cache.set(key, media)
+            self._inflight.pop(key, None).set_result(media)
+
+    async def _post(self, query: str, variables: dict) -> Tuple[dict, int]:
+        session = await get_session()
+        for _ in range(ANILIST_MAX_RETRIES + 1):
+            await self.limiter.acquire()
+            with span("anilist_request"):
+                async with session.post(ANILIST_URL, json={"query": query, "variables": variables}) as resp:
+                    wait = self.limiter.update(resp.status, resp.headers)
+                    if not wait:
+                        return await resp.json(content_type=None) or {}, resp.status
+            print(f"AniList rate limited, retrying in {wait:.0f}s")
+        return {}, 429
+
+
+anilist_limiter = RateLimiter(ANILIST_RATE_LIMIT)
+anilist_batcher = AniListBatcher(ANILIST_BATCH_WINDOW, ANILIST_BATCH_SIZE, anilist_limiter)
+
+
+# ──────────────── Filename Parser ──────────────── #
+# Alternatives in priority order; a lower index wins when several match.
+_SEASON_EPISODE_PATTERNS = [
+    r'(?<![A-Za-z])[Ss](?P<s0>\d+)(?!\d)[\s\-]*[Ee]?[Pp]?(?P<e0>\d+)',
+    r'(?i:season\s*(?P<s1>\d+)\s*episode\s*(?P<e1>\d+))',
+    r'(?i:\[s(?P<s2>\d+)\]\[e?p?(?P<e2>\d+)\])',
+    r'(?<!\d)(?P<s3>\d{1,2})[xX](?P<e3>\d{1,3})(?!\d)',    # 2x05, but not 1920x1080
+    r'\b[Ee][Pp]?\s*(?P<e4>\d{1,4})\b',                     # EP05, but not a CRC like E2328190
+]
+SEASON_EPISODE_RE = re.compile("|".join(f"(?P<p{i}>{p})" for i, p in enumerate(_SEASON_EPISODE_PATTERNS)))
+PARSE_CACHE_SIZE = int(os.environ.get("PARSE_CACHE_SIZE", 4096))
+
+
+class ParsedName(NamedTuple):
+    anime_title: str
+    season: Optional[str]
+    episode: Optional[str]
+    release_group: Optional[str]
+    video_resolution: Optional[str]
+    file_extension: Optional[str]
+    anitopy: dict                        # full anitopy result, treat as read-only
+
 
-# ──────────────── Extract Season & Episode ──────────────── #
 def extract_season_episode(filename: str) -> Tuple[Optional[str], Optional[str]]:
-    patterns = [
-        re.compile(r'[Ss](\d+)[\s\-]*[Ee]?[Pp]?(\d+)'),
-        re.compile(r'[Ss]eason\s*(\d+)\s*[Ee]pisode\s*(\d+)', re.IGNORECASE),
-        re.compile(r'\[[Ss](\d+)\]\[[Ee]?[Pp]?(\d+)\]', re.IGNORECASE),
-        re.compile(r'(\d+)[xX](\d+)'),
-        re.compile(r'\b[Ee][Pp]?\s*(\d+)\b')
-    ]
-    for p in patterns:
-        match = p.search(filename)
-        if match:
-            season = match.group(1)
-            episode = match.group(2) if len(match.groups()) > 1 else None
-            return season, episode
-    return None, None
+    best = None
+    for match in SEASON_EPISODE_RE.finditer(filename):
+        priority = int(match.lastgroup[1:])
+        if best is None or priority < best[0]:
+            best = (priority, match)
+            if priority == 0:
+                break
+    if best is None:
+        return None, None
+    priority, match = best
+    return match.groupdict().get(f"s{priority}"), match.group(f"e{priority}")
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_filename(filename: str) -> ParsedName:
+    """One regex pass plus anitopy; gaps in either are filled from the other."""
+    import anitopy
+    parsed = anitopy.parse(filename) or {}
+    season, episode = extract_season_episode(filename)
+    return ParsedName(
+        anime_title=parsed.get("anime_title") or os.path.splitext(filename)[0],
+        season=season or parsed.get("anime_season"),
+        episode=episode or parsed.get("episode_number"),
+        release_group=parsed.get("release_group"),
+        video_resolution=parsed.get("video_resolution"),
+        file_extension=parsed.get("file_extension"),
+        anitopy=parsed,
+    )
 
 
 # ──────────────── AniList Fetcher ──────────────── #
-async def fetch_anilist_data(anime_name: str, year: int = datetime.now().year) -> dict:
-    url = "https://graphql.anilist.co"
-    variables = {"search": anime_name, "seasonYear": year}
+async def fetch_anilist_data(anime_name: str, year: Optional[int] = None) -> dict:
+    """AniList `Media` for a title; `year` pins seasonYear when known.
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json={"query": ANIME_GRAPHQL_QUERY, "variables": variables}) as resp:
-            data = await resp.json()
-            return data.get("data", {}).get("Media", {}) or {}
+    Titles the local index already knows resolve straight to an ID, so only
+    unknown titles cost a search.
+    """
+    media_id = title_index.match(anime_name, year)
+    metrics.inc("title_index_hits" if media_id else "title_index_misses")
+    key = anilist_cache.id_key(media_id) if media_id else anilist_cache.make_key(anime_name, year)
+    cached = anilist_cache.get(key)
+    if cached is not None:
+        metrics.inc("anilist_cache_hits")
+        return cached
+    metrics.inc("anilist_cache_misses")
+
+    # concurrent callers share one aliased request; the batcher fills the cache
+    media = await anilist_batcher.lookup(anime_name, year, media_id)
+    if media:
+        if not media_id:
+            anilist_cache.set(anilist_cache.id_key(media["id"]), media)
+        title_index.learn(media, anime_name)
+    return media
 
 
 # ──────────────── Thumbnail Converter ──────────────── #
-async def make_thumbnail_from_url(image_url: str, size: Tuple[int, int] = (320, 320)) -> BytesIO:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(image_url) as resp:
-            img_data = await resp.read()
+_thumb_pool = ThreadPoolExecutor(max_workers=THUMB_WORKERS, thread_name_prefix="thumb")
+_thumb_inflight: Dict[str, "asyncio.Future[bytes]"] = {}
 
+
+def _render_thumbnail(img_data: bytes, size: Tuple[int, int]) -> bytes:
+    """Decode + resize + encode; runs in the thumbnail pool, never on the event loop."""
+    from PIL import Image
     image = Image.open(BytesIO(img_data))
+    image.draft("RGB", size)    # JPEG only: libjpeg decodes straight to 1/2, 1/4 or 1/8 scale
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
     image.thumbnail(size)
     thumb_io = BytesIO()
     image.save(thumb_io, format="JPEG")
-    thumb_io.seek(0)
-    return thumb_io
+    return thumb_io.getvalue()
+
+
+def _thumb_cache_path(image_url: str, size: Tuple[int, int]) -> str:
+    digest = hashlib.sha1(f"{image_url}|{size[0]}x{size[1]}".encode()).hexdigest()
+    return os.path.join(THUMB_CACHE_DIR, digest[:2], f"{digest}.jpg")
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+async def _build_thumbnail(image_url: str, size: Tuple[int, int], path: str) -> bytes:
+    session = await get_session()
+    with span("thumbnail_download"):
+        async with session.get(image_url) as resp:
+            resp.raise_for_status()   # a 404/5xx page is not a poster, and must not be cached as one
+            img_data = await resp.read()
+
+    loop = asyncio.get_running_loop()
+    with span("thumbnail_render"):
+        thumb = await loop.run_in_executor(_thumb_pool, _render_thumbnail, img_data, size)
+    await loop.run_in_executor(_thumb_pool, _write_atomic, path, thumb)
+    return thumb
+
+
+async def make_thumbnail_from_url(image_url: str, size: Tuple[int, int] = (320, 320)) -> Optional[BytesIO]:
+    """Cached thumbnail of a poster, or None if it couldn't be fetched or decoded (nothing is cached then)."""
+    import aiohttp
+    path = _thumb_cache_path(image_url, size)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return BytesIO(f.read())
+
+    # episodes of the same show arriving together share one download/render
+    future = _thumb_inflight.get(path)
+    if future is None:
+        future = asyncio.ensure_future(_build_thumbnail(image_url, size, path))
+        _thumb_inflight[path] = future
+        future.add_done_callback(lambda _: _thumb_inflight.pop(path, None))
+    try:
+        return BytesIO(await asyncio.shield(future))
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:   # PIL's decode errors are OSErrors
+        print(f"Couldn't make a thumbnail from {image_url}: {e!r}")
+        return None
 
 
 # ──────────────── Main Function ──────────────── #
@@ -80,16 +566,14 @@ async def get_anime_info(filename: str):
     """Extracts anime details, gets AniList data, creates thumbnail and returns all info."""
     
     # Step 1: Extract data from filename
-    parsed = anitopy.parse(filename)
-    anime_name = parsed.get("anime_title") or os.path.splitext(filename)[0]
-    season, episode = extract_season_episode(filename)
-    if not season:
-        season = parsed.get("anime_season") or "1"
-    if not episode:
-        episode = parsed.get("episode_number") or "1"
+    parsed = parse_filename(filename)
+    anime_name = parsed.anime_title
+    season = parsed.season or "1"
+    episode = parsed.episode or "1"
 
-    # Step 2: Fetch AniList data
-    ani_data = await fetch_anilist_data(anime_name)
+    # Step 2: Fetch AniList data (pinned to a year only when the filename has one)
+    year = parsed.anitopy.get("anime_year")
+    ani_data = await fetch_anilist_data(anime_name, int(year) if str(year).isdigit() else None)
     if not ani_data:
         return None
 
@@ -100,7 +584,7 @@ async def get_anime_info(filename: str):
     total_eps = ani_data.get("episodes", "??")
     year = ani_data.get("seasonYear", "??")
 
-    # Step 3: Make thumbnail
+    # Step 3: Make thumbnail (None: post the poster URL itself)
     thumb_io = await make_thumbnail_from_url(poster_url)
 
     # Step 4: Prepare caption for upload
@@ -127,7 +611,8 @@ async def get_anime_info(filename: str):
 
 # ──────────────── Pyrogram Example Usage ──────────────── #
 """
-from pyrogram import Client
+from pyrogram import Client, filters
+from pyrogram.types import InputMediaPhoto
 
 app = Client("uploader_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
 
@@ -141,9 +626,18 @@ async def upload_anime(_, message):
     
     # Upload with thumbnail and caption
     await message.reply_photo(
-        photo=InputMediaPhoto(info['thumb_io']),
+        photo=InputMediaPhoto(info['thumb_io'] or info['poster_url']),
         caption=info['caption']
     )
 
 app.run()
 """
+
+
+if __name__ == "__main__":
+    # python data.py import-titles anime-offline-database.json
+    import sys
+    if len(sys.argv) != 3 or sys.argv[1] != "import-titles":
+        sys.exit("usage: python data.py import-titles <media.json>")
+    added = title_index.import_file(sys.argv[2])
+    print(f"Indexed {added} new title variants ({len(title_index)} total)")
@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+# ---------------- CONFIG ---------------- #
+DB_PATH = os.environ.get("DETAILS_DB", "details.db")
+LEGACY_JSON_PATH = "details.json"     # written by the old save_details(), imported once
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))   # starts before a restart stops resuming a job
+
+# Starting point for shows that have never been tracked
+DEFAULT_DETAILS = {
+    "Solo Leveling": {"season": 1, "episode": 7},
+    "Naruto": {"season": 5, "episode": 188}
+}
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+
+# ---------------- STORAGE ---------------- #
+def _db() -> sqlite3.Connection:
+    """Open the store on first use (WAL, autocommit; writes use explicit transactions)."""
+    global _conn
+    with _lock:
+        if _conn is None:
+            conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS anime (
+                    title   TEXT PRIMARY KEY,
+                    season  INTEGER NOT NULL,
+                    episode INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS posts (
+                    title      TEXT NOT NULL,
+                    episode    INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    buttons    TEXT NOT NULL DEFAULT '[]',
+                    PRIMARY KEY (title, episode)
+                );
+                CREATE TABLE IF NOT EXISTS jobs (
+                    title     TEXT NOT NULL,
+                    episode   INTEGER NOT NULL,
+                    video_cmd TEXT NOT NULL,
+                    audio_cmd TEXT NOT NULL,
+                    started   REAL NOT NULL,
+                    attempts  INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (title, episode)
+                );
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    title   TEXT NOT NULL,
+                    episode INTEGER NOT NULL,
+                    stage   TEXT NOT NULL,
+                    name    TEXT NOT NULL,
+                    value   TEXT NOT NULL,
+                    PRIMARY KEY (title, episode, stage, name)
+                );
+                CREATE TABLE IF NOT EXISTS completed (
+                    title   TEXT NOT NULL,
+                    episode INTEGER NOT NULL,
+                    PRIMARY KEY (title, episode)
+                );
+            """)
+            if "attempts" not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            _import_legacy_json(conn)
+            _conn = conn
+    return _conn
+
+
+def _import_legacy_json(conn: sqlite3.Connection):
+    if not os.path.exists(LEGACY_JSON_PATH):
+        return
+    with open(LEGACY_JSON_PATH) as f:
+        legacy = json.load(f)
+    conn.executemany(
+        "INSERT OR IGNORE INTO anime VALUES (?, ?, ?)",
+        [(title, d["season"], d["episode"]) for title, d in legacy.items()]
+    )
+
+
+class _transaction:
+    """BEGIN IMMEDIATE … COMMIT, so concurrent writers (threads or processes) serialize."""
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn = _db()
+        _lock.acquire()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            _lock.release()
+
+
+def _seed(conn: sqlite3.Connection, anime_name: str):
+    seed = DEFAULT_DETAILS.get(anime_name, {"season": 1, "episode": 1})
+    conn.execute("INSERT OR IGNORE INTO anime VALUES (?, ?, ?)", (anime_name, seed["season"], seed["episode"]))
+
+
+# ---------------- EPISODE COUNTERS ---------------- #
+def get_details(anime_name: str):
+    """Return season and episode for given anime."""
+    row = _db().execute("SELECT season, episode FROM anime WHERE title = ?", (anime_name,)).fetchone()
+    if row is None:
+        return dict(DEFAULT_DETAILS.get(anime_name, {"season": 1, "episode": 1}))
+    return {"season": row[0], "episode": row[1]}
+
+
+# ---------------- IN-FLIGHT POSTS ---------------- #
+def save_post(anime_name: str, episode: int, message_id: int):
+    """Remember the channel post whose buttons get filled in as qualities upload."""
+    with _transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO posts (title, episode, message_id) VALUES (?, ?, ?)",
+            (anime_name, episode, message_id)
+        )
+
+
+def get_post(anime_name: str, episode: int) -> Optional[dict]:
+    row = _db().execute(
+        "SELECT message_id, buttons FROM posts WHERE title = ? AND episode = ?", (anime_name, episode)
+    ).fetchone()
+    if row is None:
+        return None
+    return {"message_id": row[0], "buttons": json.loads(row[1])}
+
+
+def add_post_button(anime_name: str, episode: int, label: str, url: str) -> List[List[str]]:
+    """Add a (label, url) button to the post (replacing one with the same label) and return all so far."""
+    with _transaction() as conn:
+        row = conn.execute(
+            "SELECT buttons FROM posts WHERE title = ? AND episode = ?", (anime_name, episode)
+        ).fetchone()
+        buttons = json.loads(row[0]) if row else []
+        # a resumed job may upload a quality again
+        buttons = [b for b in buttons if b[0] != label] + [[label, url]]
+        conn.execute(
+            "UPDATE posts SET buttons = ? WHERE title = ? AND episode = ?", (json.dumps(buttons), anime_name, episode)
+        )
+    return buttons
+
+
+def complete_episode(anime_name: str, episode: int):
+    """Drop the in-flight post and job checkpoints and advance the counter in one transaction.
+
+    Backfilled episodes can finish out of order, so finished episodes ahead of the
+    counter are remembered and the counter moves past every consecutive finished one.
+    """
+    with _transaction() as conn:
+        conn.execute("DELETE FROM posts WHERE title = ? AND episode = ?", (anime_name, episode))
+        conn.execute("DELETE FROM jobs WHERE title = ? AND episode = ?", (anime_name, episode))
+        conn.execute("DELETE FROM checkpoints WHERE title = ? AND episode = ?", (anime_name, episode))
+        _seed(conn, anime_name)
+        conn.execute("INSERT OR IGNORE INTO completed VALUES (?, ?)", (anime_name, episode))
+        (counter,) = conn.execute("SELECT episode FROM anime WHERE title = ?", (anime_name,)).fetchone()
+        while conn.execute(
+            "SELECT 1 FROM completed WHERE title = ? AND episode = ?", (anime_name, counter)
+        ).fetchone():
+            counter += 1
+        conn.execute("UPDATE anime SET episode = ? WHERE title = ?", (counter, anime_name))
+        conn.execute("DELETE FROM completed WHERE title = ? AND episode < ?", (anime_name, counter))
+
+
+def episode_done(anime_name: str, episode: int) -> bool:
+    """True if the episode is behind the counter or already finished by a backfill."""
+    if episode < get_details(anime_name)["episode"]:
+        return True
+    return _db().execute(
+        "SELECT 1 FROM completed WHERE title = ? AND episode = ?", (anime_name, episode)
+    ).fetchone() is not None
+
+
+# ---------------- JOB CHECKPOINTS ---------------- #
+def start_job(anime_name: str, episode: int, video_cmd: str, audio_cmd: str):
+    """Record that this episode is being processed, so a restart can resume it.
+
+    Every start counts as an attempt; the row goes away in complete_episode().
+    """
+    with _transaction() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, ?, 0)", (anime_name, episode, video_cmd, audio_cmd, time.time())
+        )
+        conn.execute("UPDATE jobs SET attempts = attempts + 1 WHERE title = ? AND episode = ?", (anime_name, episode))
+
+
+def unfinished_jobs() -> List[dict]:
+    """Episodes started but never completed, oldest first.
+
+    Jobs already started JOB_MAX_ATTEMPTS times (missing inputs, qualities that
+    never upload, ...) are left out; a backfill or the weekly run can still retry them.
+    """
+    rows = _db().execute(
+        "SELECT title, episode, video_cmd, audio_cmd FROM jobs WHERE attempts < ? ORDER BY started", (JOB_MAX_ATTEMPTS,)
+    ).fetchall()
+    return [{"title": r[0], "episode": r[1], "video_cmd": r[2], "audio_cmd": r[3]} for r in rows]
+
+
+def save_checkpoint(anime_name: str, episode: int, stage: str, name: str, value: dict):
+    with _transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+            (anime_name, episode, stage, name, json.dumps(value))
+        )
+
+
+def get_checkpoints(anime_name: str, episode: int, stage: str) -> Dict[str, dict]:
+    rows = _db().execute(
+        "SELECT name, value FROM checkpoints WHERE title = ? AND episode = ? AND stage = ?", (anime_name, episode, stage)
+    ).fetchall()
+    return {name: json.loads(value) for name, value in rows}
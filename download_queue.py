@@ -0,0 +1,136 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+# ---------------- CONFIG ---------------- #
+DB_PATH = os.environ.get("DOWNLOAD_QUEUE_DB", "downloads.db")
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+
+# ---------------- STORAGE ---------------- #
+def _db() -> sqlite3.Connection:
+    global _conn
+    with _lock:
+        if _conn is None:
+            conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS downloads (
+                    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id       INTEGER NOT NULL,
+                    chat_id       INTEGER NOT NULL,
+                    season_id     TEXT NOT NULL,
+                    episode       TEXT NOT NULL,
+                    dub_lang      TEXT NOT NULL,
+                    dl_subs       TEXT NOT NULL,
+                    default_audio TEXT NOT NULL,
+                    default_sub   TEXT NOT NULL,
+                    qual          TEXT NOT NULL,
+                    status        TEXT NOT NULL DEFAULT 'queued',
+                    created       REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS downloads_status ON downloads (status, user_id);
+            """)
+            # jobs that were running when the bot stopped start over
+            conn.execute("UPDATE downloads SET status = 'queued' WHERE status = 'running'")
+            _conn = conn
+    return _conn
+
+
+# ---------------- EPISODE SPECS ---------------- #
+def parse_episodes(spec: str) -> List[str]:
+    """'1-12,15' -> ['1', ..., '12', '15']; raises ValueError on a malformed spec."""
+    episodes = []
+    for part in spec.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = (int(x) for x in part.split("-", 1))
+            if start > end:
+                raise ValueError(f"bad episode range: {part}")
+            episodes.extend(str(e) for e in range(start, end + 1))
+        elif part:
+            episodes.append(str(int(part)))
+    if not episodes:
+        raise ValueError("no episodes given")
+    return list(dict.fromkeys(episodes))
+
+
+# ---------------- QUEUE ---------------- #
+def enqueue(user_id: int, chat_id: int, season_id: str, episodes: List[str], dub_lang: str, dl_subs: str,
+            default_audio: str, default_sub: str, qual: str) -> List[int]:
+    """Queue one job per episode and return their ids."""
+    db = _db()
+    ids = []
+    with _lock:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for episode in episodes:
+                cur = db.execute(
+                    "INSERT INTO downloads (user_id, chat_id, season_id, episode, dub_lang, dl_subs, "
+                    "default_audio, default_sub, qual, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, chat_id, season_id, episode, dub_lang, dl_subs, default_audio, default_sub, qual,
+                     time.time())
+                )
+                ids.append(cur.lastrowid)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+    return ids
+
+
+def claim_next() -> Optional[sqlite3.Row]:
+    """Mark the next job running and return it.
+
+    Fairness: the user with the fewest running jobs goes first, then the oldest job,
+    so one user's season backfill doesn't starve everyone else.
+    """
+    db = _db()
+    with _lock:
+        row = db.execute("""
+            SELECT d.* FROM downloads d
+            WHERE d.status = 'queued'
+            ORDER BY (SELECT COUNT(*) FROM downloads r WHERE r.user_id = d.user_id AND r.status = 'running'), d.id
+            LIMIT 1
+        """).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE downloads SET status = 'running' WHERE id = ?", (row["id"],))
+    return row
+
+
+def finish(job_id: int, status: str):
+    """status: 'done', 'failed' or 'cancelled'."""
+    db = _db()
+    with _lock:
+        db.execute("UPDATE downloads SET status = ? WHERE id = ?", (status, job_id))
+
+
+def cancel(user_id: int, job_id: Optional[int] = None) -> Tuple[List[int], List[int]]:
+    """Cancel one of the user's jobs (or all of them); returns (cancelled ids, ids that were running)."""
+    db = _db()
+    where, args = "user_id = ? AND status IN ('queued', 'running')", [user_id]
+    if job_id is not None:
+        where += " AND id = ?"
+        args.append(job_id)
+    with _lock:
+        rows = db.execute(f"SELECT id, status FROM downloads WHERE {where}", args).fetchall()
+        db.execute(f"UPDATE downloads SET status = 'cancelled' WHERE {where}", args)
+    return [r["id"] for r in rows], [r["id"] for r in rows if r["status"] == "running"]
+
+
+def list_jobs(user_id: Optional[int] = None) -> List[sqlite3.Row]:
+    """Queued and running jobs, oldest first."""
+    query = "SELECT * FROM downloads WHERE status IN ('queued', 'running')"
+    args = []
+    if user_id is not None:
+        query += " AND user_id = ?"
+        args.append(user_id)
+    db = _db()
+    with _lock:
+        return db.execute(query + " ORDER BY id", args).fetchall()
@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import asyncio
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from metrics import metrics, span
+
+# ---------------- CONFIG ---------------- #
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.environ.get("FFPROBE_BIN", "ffprobe")
+MERGE_CONCURRENCY = int(os.environ.get("MERGE_CONCURRENCY", os.cpu_count() or 2))
+PROBE_CONCURRENCY = int(os.environ.get("PROBE_CONCURRENCY", 8))
+PROBE_CACHE_SIZE = 1024
+
+# renditions made from the best source when the downloader skipped a quality (CPU-only x264)
+TRANSCODE_THREADS = int(os.environ.get("TRANSCODE_THREADS", 0))         # 0 = let ffmpeg decide
+TRANSCODE_CONCURRENCY = int(os.environ.get("TRANSCODE_CONCURRENCY", 1))
+TRANSCODE_PRESET = os.environ.get("TRANSCODE_PRESET", "veryfast")
+TRANSCODE_CRF = os.environ.get("TRANSCODE_CRF", "23")
+
+STREAM_CHUNK_SIZE = 512 * 1024        # Telegram's upload part size
+# fit within 320x320 (Telegram drops bigger video thumbs), portrait sources included; never upscale
+THUMB_SCALE = "scale=w='min(320,iw)':h='min(320,ih)':force_original_aspect_ratio=decrease"
+
+# codecs ffmpeg can copy into fragmented MP4 without re-encoding
+STREAMABLE_VIDEO = {"h264", "hevc", "av1", "vp9", "mpeg4"}
+STREAMABLE_AUDIO = {"aac", "mp3", "ac3", "eac3", "opus", "flac", "alac"}
+
+_merge_slots = asyncio.Semaphore(MERGE_CONCURRENCY)
+_transcode_slots = asyncio.Semaphore(TRANSCODE_CONCURRENCY)
+
+
+class FFmpegError(Exception):
+    """ffmpeg exited non-zero; `stderr` holds its error output."""
+
+    def __init__(self, cmd: List[str], returncode: int, stderr: str):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+        tail = stderr.strip().splitlines()[-1:] or ["no output"]
+        super().__init__(f"ffmpeg exited with {returncode}: {tail[0]}")
+
+
+# ---------------- FFMPEG RUNNER ---------------- #
+async def run_ffmpeg(args: List[str], progress: Optional[Callable[[Dict[str, str]], None]] = None) -> float:
+    """Run ffmpeg as an asyncio subprocess and return the wall time in seconds.
+
+    `progress` receives each `-progress` block (out_time, speed, total_size, ...).
+    """
+    cmd = [FFMPEG_BIN, "-hide_banner", "-nostdin", "-y", "-loglevel", "error", "-progress", "pipe:1", *args]
+    start = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+
+    async def read_progress():
+        block = {}
+        async for raw in process.stdout:
+            key, _, value = raw.decode(errors="replace").strip().partition("=")
+            block[key] = value
+            if key == "progress":
+                if progress:
+                    progress(block)
+                block = {}
+
+    try:
+        _, stderr = await asyncio.gather(read_progress(), process.stderr.read())
+    except BaseException:
+        # cancelled (or the progress callback failed): don't leave ffmpeg writing behind us
+        process.kill()
+        await process.wait()
+        raise
+    returncode = await process.wait()
+    if returncode != 0:
+        raise FFmpegError(cmd, returncode, stderr.decode(errors="replace"))
+    return time.monotonic() - start
+
+
+# ---------------- MERGE ---------------- #
+async def merge_video_audio(video_path: str, audio_path: str, output_path: str,
+                            progress: Optional[Callable[[Dict[str, str]], None]] = None) -> float:
+    """Remux video + audio without re-encoding; at most MERGE_CONCURRENCY run at once."""
+    async with _merge_slots:
+        with span("merge"):
+            elapsed = await run_ffmpeg(
+                ["-i", video_path, "-i", audio_path, "-map", "0:v:0", "-map", "1:a:0", "-c", "copy", output_path],
+                progress,
+            )
+    metrics.add_bytes("merged", os.path.getsize(output_path))
+    return elapsed
+
+
+# ---------------- PROBING ---------------- #
+class MediaInfo(NamedTuple):
+    path: str
+    size: int
+    width: int = 0
+    height: int = 0
+    duration: float = 0.0
+    video_codec: str = ""
+    audio_codec: str = ""
+
+    @property
+    def label(self) -> Optional[str]:
+        """"1080p" etc. from the real frame height; None if ffprobe found no video."""
+        return f"{self.height}p" if self.height else None
+
+
+_probe_cache: "OrderedDict[Tuple[str, int, int], MediaInfo]" = OrderedDict()
+_probe_slots = asyncio.Semaphore(PROBE_CONCURRENCY)
+
+
+async def _ffprobe(path: str, size: int) -> MediaInfo:
+    async with _probe_slots:
+        process = await asyncio.create_subprocess_exec(
+            FFPROBE_BIN, "-v", "error", "-of", "json",
+            "-show_entries", "stream=codec_type,codec_name,width,height:format=duration", path,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise FFmpegError([FFPROBE_BIN, path], process.returncode, stderr.decode(errors="replace"))
+
+    data = json.loads(stdout or b"{}")
+    video = next((s for s in data.get("streams", []) if s.get("codec_type") == "video"), {})
+    audio = next((s for s in data.get("streams", []) if s.get("codec_type") == "audio"), {})
+    return MediaInfo(
+        path, size,
+        width=int(video.get("width") or 0),
+        height=int(video.get("height") or 0),
+        duration=float(data.get("format", {}).get("duration") or 0),
+        video_codec=video.get("codec_name", ""),
+        audio_codec=audio.get("codec_name", ""),
+    )
+
+
+async def probe(path: str) -> MediaInfo:
+    """ffprobe `path`, cached by (path, size, mtime) so unchanged files are probed once.
+
+    Raises OSError if ffprobe (or the file) is missing and FFmpegError if it fails.
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    info = _probe_cache.get(key)
+    if info is not None:
+        _probe_cache.move_to_end(key)
+        return info
+    info = await _ffprobe(path, st.st_size)
+    _probe_cache[key] = info
+    if len(_probe_cache) > PROBE_CACHE_SIZE:
+        _probe_cache.popitem(last=False)
+    return info
+
+
+async def probe_videos(directory: str, extensions: Tuple[str, ...] = (".mp4", ".mkv")) -> List[MediaInfo]:
+    """Probe every video in `directory` in parallel, lowest resolution first.
+
+    Files ffprobe can't read keep height 0 and sort by size among themselves,
+    which is what the old size-based ordering did.
+    """
+    paths = [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(extensions)]
+    results = await asyncio.gather(*(probe(p) for p in paths), return_exceptions=True)
+    infos = []
+    for path, result in zip(paths, results):
+        if isinstance(result, Exception):
+            print(f"Couldn't probe {path}: {result}")
+            result = MediaInfo(path, os.path.getsize(path))
+        infos.append(result)
+    return sorted(infos, key=lambda i: (i.height, i.size))
+
+
+async def make_video_thumbnail(video_path: str, output_path: str, duration: float = 0.0) -> Optional[str]:
+    """Grab one frame (10% in) as a ≤320 px JPEG, Telegram's limit for video thumbs.
+
+    Returns `output_path`, or None if ffmpeg couldn't produce it.
+    """
+    try:
+        await run_ffmpeg(["-ss", f"{duration * 0.1:.2f}", "-i", video_path, "-frames:v", "1",
+                          "-vf", THUMB_SCALE, "-q:v", "5", output_path])
+    except (FFmpegError, OSError) as e:
+        print(f"Couldn't make a thumbnail for {video_path}: {e}")
+        return None
+    return output_path
+
+
+# ---------------- RENDITIONS ---------------- #
+def rendition_args(source: str, outputs: Dict[int, str], threads: int = TRANSCODE_THREADS) -> List[str]:
+    """ffmpeg arguments that decode `source` once and encode one output per height.
+
+    The decoded frames go through a split filter, each branch is scaled and encoded
+    by its own libx264 instance; `threads` is shared out between the encoders.
+    """
+    heights = sorted(outputs)
+    per_encoder = max(1, threads // len(heights)) if threads else 0
+    graph = f"[0:v]split={len(heights)}" + "".join(f"[s{i}]" for i in range(len(heights))) + ";" + ";".join(
+        f"[s{i}]scale=-2:{h}[v{i}]" for i, h in enumerate(heights)
+    )
+    args = ["-threads", str(threads), "-i", source, "-filter_complex", graph]
+    if threads:
+        args += ["-filter_complex_threads", str(threads)]
+    for i, h in enumerate(heights):
+        args += ["-map", f"[v{i}]", "-an", "-c:v", "libx264", "-preset", TRANSCODE_PRESET, "-crf", TRANSCODE_CRF,
+                 "-threads", str(per_encoder), "-movflags", "+faststart", "-f", "mp4", outputs[h]]
+    return args
+
+
+async def make_renditions(source: str, outputs: Dict[int, str], threads: int = TRANSCODE_THREADS,
+                          progress: Optional[Callable[[Dict[str, str]], None]] = None) -> float:
+    """Encode `source` to every {height: path} in `outputs` with a single decode; returns wall time.
+
+    Outputs are written under a temporary name and renamed once ffmpeg succeeds,
+    so a crash never leaves a truncated rendition behind.
+    """
+    partial = {h: f"{path}.part" for h, path in outputs.items()}
+    async with _transcode_slots:
+        with span("transcode"):
+            try:
+                elapsed = await run_ffmpeg(rendition_args(source, partial, threads), progress)
+            except BaseException:
+                for path in partial.values():
+                    if os.path.exists(path):
+                        os.remove(path)
+                raise
+    for h, path in outputs.items():
+        os.replace(partial[h], path)
+    return elapsed
+
+
+async def fill_missing_qualities(videos: List[MediaInfo], heights: List[int], directory: str) -> List[MediaInfo]:
+    """Make the target `heights` the downloader didn't deliver from the best source.
+
+    Only downscales, and only until there are as many videos as target heights.
+    Returns all videos, lowest resolution first, like probe_videos().
+    """
+    if not videos or len(videos) >= len(heights):
+        return videos
+    best = max(videos, key=lambda v: (v.height, v.size))
+    have = {v.height for v in videos}
+    missing = [h for h in heights if h < best.height and h not in have][:len(heights) - len(videos)]
+    if not missing:
+        return videos
+
+    stem = os.path.splitext(os.path.basename(best.path))[0]
+    outputs = {h: os.path.join(directory, f"{stem}_{h}p.mp4") for h in missing}
+    print(f"Transcoding {', '.join(f'{h}p' for h in missing)} from {best.label}...")
+    elapsed = await make_renditions(best.path, outputs)
+    print(f"Transcoded {len(missing)} rendition(s) in {elapsed:.1f}s")
+    made = await asyncio.gather(*(probe(p) for p in outputs.values()))
+    return sorted([*videos, *made], key=lambda i: (i.height, i.size))
+
+
+# ---------------- STREAMING REMUX ---------------- #
+async def can_stream(video_path: str, audio_path: str) -> bool:
+    """True when the pair can be copied into fragmented MP4 on a pipe."""
+    try:
+        video, audio = await asyncio.gather(probe(video_path), probe(audio_path))
+    except (OSError, FFmpegError):
+        return False
+    return video.video_codec in STREAMABLE_VIDEO and audio.audio_codec in STREAMABLE_AUDIO
+
+
+async def remux_stream(video_path: str, audio_path: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Remux video + audio to fragmented MP4 on ffmpeg's stdout, yielding `chunk_size` pieces.
+
+    Nothing touches the disk; every chunk but the last is exactly `chunk_size` bytes.
+    Raises FFmpegError after the last chunk if ffmpeg failed.
+    """
+    cmd = [
+        FFMPEG_BIN, "-hide_banner", "-nostdin", "-loglevel", "error",
+        "-i", video_path, "-i", audio_path, "-map", "0:v:0", "-map", "1:a:0", "-c", "copy",
+        "-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof", "pipe:1",
+    ]
+    async with _merge_slots:
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        stderr = asyncio.ensure_future(process.stderr.read())
+        finished, produced = False, 0
+        try:
+            while True:
+                try:
+                    chunk = await process.stdout.readexactly(chunk_size)
+                except asyncio.IncompleteReadError as e:
+                    finished = True
+                    if e.partial:
+                        produced += len(e.partial)
+                        yield e.partial
+                    break
+                produced += len(chunk)
+                yield chunk
+        finally:
+            if not finished and process.returncode is None:
+                process.kill()
+            returncode = await process.wait()
+            metrics.add_bytes("merged", produced)
+
+        if returncode != 0:
+            raise FFmpegError(cmd, returncode, (await stderr).decode(errors="replace"))
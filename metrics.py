@@ -0,0 +1,201 @@
+import os
+import time
+import asyncio
+import cProfile
+import importlib
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+# ---------------- CONFIG ---------------- #
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))          # 0 = no HTTP endpoint
+PROFILE_JOBS = os.environ.get("PROFILE_JOBS") == "1"          # cProfile each job into PROFILE_DIR
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "./profiles")
+
+
+# ---------------- REGISTRY ---------------- #
+class StageStats:
+    __slots__ = ("count", "errors", "active", "total", "max", "last")
+
+    def __init__(self):
+        self.count = self.errors = self.active = 0
+        self.total = self.max = self.last = 0.0
+
+
+class Metrics:
+    """Stage timings, byte counters and queue-depth gauges for the whole process.
+
+    Recording is a perf_counter() pair and a few dict updates, so spans can wrap
+    every stage in production.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {}
+        self.bytes: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self.started = time.time()
+        self._lock = threading.Lock()    # spans also close in executor threads
+
+    def _stage(self, name: str) -> StageStats:
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages.setdefault(name, StageStats())
+        return stats
+
+    @contextmanager
+    def span(self, stage: str):
+        """Time the block as one run of `stage` (works in sync and async code)."""
+        stats = self._stage(stage)
+        with self._lock:
+            stats.active += 1
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats.active -= 1
+                stats.count += 1
+                stats.errors += failed
+                stats.total += elapsed
+                stats.last = elapsed
+                stats.max = max(stats.max, elapsed)
+
+    def add_bytes(self, kind: str, n: int):
+        """kind: "downloaded", "merged" or "uploaded"."""
+        with self._lock:
+            self.bytes[kind] = self.bytes.get(kind, 0) + n
+
+    def inc(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name: str, fn: Callable[[], float]):
+        """Register a queue depth (or any number) read at scrape time."""
+        self.gauges[name] = fn
+
+    def _read_gauges(self) -> Dict[str, float]:
+        values = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                values[name] = fn()
+            except Exception:
+                pass
+        return values
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stages = {
+                name: {"count": s.count, "errors": s.errors, "active": s.active, "total_seconds": round(s.total, 3),
+                       "max_seconds": round(s.max, 3), "last_seconds": round(s.last, 3)}
+                for name, s in self.stages.items()
+            }
+            data = {"uptime_seconds": round(time.time() - self.started), "stages": stages,
+                    "bytes": dict(self.bytes), "counters": dict(self.counters)}
+        data["queues"] = self._read_gauges()
+        return data
+
+    def render_prometheus(self) -> str:
+        data = self.snapshot()
+        stages = data["stages"]
+        lines = ["# TYPE pipeline_stage_seconds summary"]
+        for name, s in stages.items():
+            lines += [f'pipeline_stage_seconds_count{{stage="{name}"}} {s["count"]}',
+                      f'pipeline_stage_seconds_sum{{stage="{name}"}} {s["total_seconds"]}']
+        for family, kind, field in (
+            ("pipeline_stage_max_seconds", "gauge", "max_seconds"),
+            ("pipeline_stage_errors_total", "counter", "errors"),
+            ("pipeline_stage_active", "gauge", "active"),
+        ):
+            lines.append(f"# TYPE {family} {kind}")
+            lines += [f'{family}{{stage="{name}"}} {s[field]}' for name, s in stages.items()]
+        for family, kind, label, values in (
+            ("pipeline_bytes_total", "counter", "kind", data["bytes"]),
+            ("pipeline_events_total", "counter", "event", data["counters"]),
+            ("pipeline_queue_depth", "gauge", "queue", data["queues"]),
+        ):
+            lines.append(f"# TYPE {family} {kind}")
+            lines += [f'{family}{{{label}="{k}"}} {v}' for k, v in values.items()]
+        lines += ["# TYPE pipeline_uptime_seconds gauge", f"pipeline_uptime_seconds {data['uptime_seconds']}"]
+        return "\n".join(lines) + "\n"
+
+    def format_stats(self) -> str:
+        """Short human summary for the /stats command."""
+        data = self.snapshot()
+        lines = [f"📊 Uptime {data['uptime_seconds'] // 3600}h {data['uptime_seconds'] % 3600 // 60}m"]
+        for name, s in sorted(data["stages"].items(), key=lambda kv: -kv[1]["total_seconds"]):
+            avg = s["total_seconds"] / s["count"] if s["count"] else 0
+            lines.append(
+                f"• {name}: {s['count']}× avg {avg:.1f}s max {s['max_seconds']:.1f}s"
+                + (f", {s['active']} running" if s["active"] else "")
+                + (f", {s['errors']} failed" if s["errors"] else "")
+            )
+        for kind, n in data["bytes"].items():
+            lines.append(f"• {kind}: {n / 2**30:.2f} GiB")
+        for event, n in data["counters"].items():
+            lines.append(f"• {event}: {n}")
+        for queue, depth in data["queues"].items():
+            lines.append(f"• queue {queue}: {depth}")
+        return "\n".join(lines)
+
+
+metrics = Metrics()
+span = metrics.span
+
+
+# ---------------- PROFILING ---------------- #
+_profiling = threading.Lock()
+
+
+@contextmanager
+def profile_job(name: str):
+    """With PROFILE_JOBS=1, cProfile the block into PROFILE_DIR/<name>_<time>.prof.
+
+    Only one profile runs at a time (cProfile can't nest), and it sees everything
+    the event loop does meanwhile, not just this job.
+    """
+    if not PROFILE_JOBS or not _profiling.acquire(blocking=False):
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            slug = "".join(c if c.isalnum() else "_" for c in name)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, f"{slug}_{int(time.time())}.prof"))
+    finally:
+        _profiling.release()
+
+
+# ---------------- HTTP ENDPOINT ---------------- #
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[object]:
+    """Serve /metrics (Prometheus text) and /metrics.json; returns the runner, or None if disabled."""
+    if not port:
+        return None
+    # aiohttp takes a noticeable fraction of a second to import; doing it on a
+    # worker thread keeps a just-started bot answering messages meanwhile
+    web = await asyncio.to_thread(importlib.import_module, "aiohttp.web")
+
+    async def prometheus(_):
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
+
+    async def as_json(_):
+        return web.json_response(metrics.snapshot())
+
+    server = web.Application()
+    server.add_routes([web.get("/metrics", prometheus), web.get("/metrics.json", as_json)])
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"📈 Metrics on http://{host}:{port}/metrics")
+    return runner
@@ -1,54 +1,35 @@
 import os
-import pytz
-import ffmpeg
 import asyncio
-import subprocess
 from datetime import datetime
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from pyrogram import Client
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from details import get_details, increment_episode
-from anime_utils import get_anime_data
+import core
+from checkpoints import EpisodeCheckpoint
+from details import add_post_button, complete_episode, get_post, save_post, start_job
+from pipeline import create_workspace, remove_workspace, run_pipeline, upload_slots
+from throttle import throttle
+from uploader import send_remuxed_video, send_cached
 
 # ---------------- CONFIG ---------------- #
-API_ID = 123456
-API_HASH = "your_api_hash"
-BOT_TOKEN = "your_bot_token"
-
 UPLOAD_CHAT_ID = -1001234567890     # main upload channel
 DATABASE_CHAT_ID = -1009876543210   # database channel (for file storage)
+# qualities to post; ones the downloader didn't deliver are transcoded from the best source
+TARGET_HEIGHTS = [int(h) for h in os.environ.get("TARGET_HEIGHTS", "480,720,1080").split(",")]
 
-DOWNLOAD_PATH = "./downloads"
-AUDIO_PATH = "./audio"
-MERGED_PATH = "./merged"
-TIMEZONE = pytz.timezone("Asia/Kolkata")
-
-bot = Client("auto_uploader", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
-
-# Track ongoing uploads
-episode_post_map = {}  # { "AnimeName": {"episode": int, "message_id": int, "buttons": []} }
-
-# ---------------- UTILITIES ---------------- #
-async def run_cmd(cmd: str):
-    process = await asyncio.create_subprocess_shell(cmd)
-    await process.communicate()
+bot, upload_pool = core.create_bot("auto_uploader")
 
-def get_sorted_videos():
-    files = [os.path.join(DOWNLOAD_PATH, f) for f in os.listdir(DOWNLOAD_PATH) if f.endswith(".mp4")]
-    files.sort(key=lambda x: os.path.getsize(x))
-    return files[:3]
+# ---------------- CORE FUNCTION ---------------- #
+async def process_anime(title, video_dl_cmd, audio_dl_cmd, episode=None):
+    """Process `episode` of `title` (default: the next one) unless it is already running."""
+    await core.run_episode(process_episode, title, video_dl_cmd, audio_dl_cmd, episode)
 
-async def merge(video, audio, output):
-    ffmpeg.input(video).input(audio).output(output, c="copy", loglevel="quiet").run(overwrite_output=True)
 
-# ---------------- CORE FUNCTION ---------------- #
-async def process_anime(title, video_dl_cmd, audio_dl_cmd):
-    os.makedirs(DOWNLOAD_PATH, exist_ok=True)
-    os.makedirs(AUDIO_PATH, exist_ok=True)
-    os.makedirs(MERGED_PATH, exist_ok=True)
+async def process_episode(title, season, episode, video_dl_cmd, audio_dl_cmd):
+    from anime_utils import get_anime_data   # only episode jobs need it
 
-    info = get_details(title)
-    season, episode = info["season"], info["episode"]
+    workspace = create_workspace(title, season, episode)
+    # finished stages survive a crash; a rerun of this episode skips them
+    start_job(title, episode, video_dl_cmd, audio_dl_cmd)
+    checkpoint = EpisodeCheckpoint(title, episode, workspace)
 
     ani = get_anime_data(title)
     caption = (
@@ -58,120 +39,90 @@ async def process_anime(title, video_dl_cmd, audio_dl_cmd):
         f"{ani['desc']}..."
     )
 
-    # STEP 1: Post cover with caption first
-    post = await bot.send_photo(
-        chat_id=UPLOAD_CHAT_ID,
-        photo=ani["image"],
-        caption=caption,
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⏳ Processing...", callback_data="wait")]])
-    )
-
-    # Store in map for later editing
-    episode_post_map[title] = {
-        "episode": episode,
-        "message_id": post.id,
-        "buttons": []
-    }
-
-    print(f"[{datetime.now(TIMEZONE).strftime('%H:%M')}] Posted {title} Ep {episode}, starting downloads...")
-
-    # STEP 2: Download video & audio
-    await run_cmd(video_dl_cmd)
-    await run_cmd(audio_dl_cmd)
-
-    audio_files = [os.path.join(AUDIO_PATH, f) for f in os.listdir(AUDIO_PATH) if f.endswith((".m4a", ".aac", ".mp3"))]
-    if not audio_files:
-        print("❌ No audio found.")
+    # STEP 1: Post cover with caption first (unless an interrupted run already did)
+    existing = get_post(title, episode)
+    if existing:
+        post_id = existing["message_id"]
+    else:
+        # (sent by the main bot, which edits its buttons later)
+        post = await throttle.call(bot, UPLOAD_CHAT_ID, lambda: send_cached(
+            bot, "send_photo", UPLOAD_CHAT_ID, f"url:{ani['image']}", ani["image"],
+            caption=caption,
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⏳ Processing...", callback_data="wait")]])
+        ))
+        post_id = post.id
+
+        # Persist the post so its buttons can still be edited after a restart
+        save_post(title, episode, post_id)
+
+    print(f"[{datetime.now(core.timezone()).strftime('%H:%M')}] Posted {title} Ep {episode}, starting downloads...")
+
+    # STEP 2: Download video & audio together; one failing cancels the other and fails the job
+    await core.download_episode(checkpoint, workspace, video_dl_cmd, audio_dl_cmd)
+
+    prepared = await core.prepare_episode(title, season, episode, workspace, checkpoint, TARGET_HEIGHTS)
+    if prepared is None:
         return
-    audio_file = audio_files[0]
-
-    videos = get_sorted_videos()
-    qualities = ["480p", "720p", "1080p"]
-
-    for idx, vid in enumerate(videos):
-        res = qualities[idx]
-        merged_file = os.path.join(MERGED_PATH, f"{title}_S{season:02d}E{episode:02d}_{res}.mp4")
-
-        print(f"Merging {res} for {title} Ep {episode}...")
-        await merge(vid, audio_file, merged_file)
-
-        # Upload to DB channel
-        print(f"Uploading {res} to DB...")
-        db_msg = await bot.send_video(
-            chat_id=DATABASE_CHAT_ID,
-            video=merged_file,
-            caption=f"{title} S{season:02d}E{episode:02d} [{res}]",
-            supports_streaming=True
-        )
-
-        # Create download link
-        link = f"https://t.me/c/{str(db_msg.chat.id)[4:]}/{db_msg.id}"
-
-        # Add new button
-        episode_post_map[title]["buttons"].append(
-            [InlineKeyboardButton(f"{res}", url=link)]
-        )
-
-        # Update the same post buttons dynamically
-        await bot.edit_message_reply_markup(
-            chat_id=UPLOAD_CHAT_ID,
-            message_id=episode_post_map[title]["message_id"],
-            reply_markup=InlineKeyboardMarkup(episode_post_map[title]["buttons"])
-        )
+    audio_file, jobs = prepared
+    # qualities uploaded before an interruption have had their videos deleted already
+    expected = len({job[0] for job in jobs} | set(checkpoint.uploads()))
+
+    async def upload(job):
+        res, vid, merged_file, streamed, cache_key, probed = job
+        if checkpoint.uploaded(res):
+            print(f"{res} was already uploaded")
+        else:
+            # Upload to DB channel
+            print(f"Uploading {res} to DB...")
+            async with upload_slots:
+                db_msg = await send_remuxed_video(
+                    upload_pool, DATABASE_CHAT_ID, vid, audio_file, merged_file,
+                    caption=f"{title} S{season:02d}E{episode:02d} [{res}]",
+                    streamed=streamed,
+                    cache_key=cache_key,
+                    info=probed
+                )
+
+            # Create download link
+            link = f"https://t.me/c/{str(db_msg.chat.id)[4:]}/{db_msg.id}"
+
+            # Add new button
+            buttons = add_post_button(title, episode, res, link)
+            checkpoint.mark_uploaded(res, vid, db_msg)
+
+            # Update the same post buttons dynamically; edits still waiting on the
+            # rate limit are coalesced, so only the newest button set is sent
+            edits.append(asyncio.ensure_future(throttle.edit(
+                bot, "edit_message_reply_markup", UPLOAD_CHAT_ID, post_id,
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(label, url=url)] for label, url in buttons])
+            )))
 
         os.remove(vid)
-        os.remove(merged_file)
-
-        # If 3 qualities done → cleanup
-        if len(episode_post_map[title]["buttons"]) == 3:
-            del episode_post_map[title]
-            increment_episode(title)
-            os.remove(audio_file)
-            print(f"✅ {title} Ep {episode} complete! All 3 qualities uploaded.")
-            break
-
-# ---------------- SCHEDULE JOBS ---------------- #
-async def schedule_jobs():
-    scheduler = AsyncIOScheduler(timezone=TIMEZONE)
-
-    # Solo Leveling - Wednesday 9 AM
-    scheduler.add_job(
-        lambda: asyncio.create_task(
-            process_anime(
-                "Solo Leveling",
-                "python animepahe_dl.py --anime solo-leveling --latest",
-                "python crunchy_audio_dl.py --anime solo-leveling"
-            )
-        ),
-        trigger="cron", day_of_week="wed", hour=9, minute=0
-    )
-
-    # Naruto - Wednesday 10 PM
-    scheduler.add_job(
-        lambda: asyncio.create_task(
-            process_anime(
-                "Naruto",
-                "python nx_downloader.py --anime naruto --latest",
-                "python crunchy_audio_dl.py --anime naruto"
-            )
-        ),
-        trigger="cron", day_of_week="wed", hour=22, minute=0
-    )
-
-    scheduler.start()
-    print("✅ Scheduler started (Asia/Kolkata)")
-    while True:
-        await asyncio.sleep(60)
+        if os.path.exists(merged_file):
+            os.remove(merged_file)
+
+    # quality N+1 merges while quality N uploads
+    edits = []
+    try:
+        await run_pipeline(jobs, core.merge_step(upload_pool, checkpoint, title, episode, audio_file), upload)
+    except asyncio.CancelledError:
+        for edit in edits:   # don't hold a shutdown up behind rate-limited edits
+            edit.cancel()
+        raise
+    finally:
+        # an edit's error must not replace the pipeline's (or end the job after a good run)
+        for result in await asyncio.gather(*edits, return_exceptions=True):
+            if isinstance(result, Exception):
+                print(f"Couldn't update the buttons of {title} Ep {episode}: {result!r}")
+
+    # If every quality is done → cleanup
+    if expected and len(checkpoint.uploads()) >= expected:
+        complete_episode(title, episode)
+        remove_workspace(workspace)
+        print(f"✅ {title} Ep {episode} complete! All {expected} qualities uploaded.")
 
 # ---------------- BOT START ---------------- #
-@bot.on_message()
-async def start(_, msg):
-    if msg.text == "/start":
-        await msg.reply("🚀 Auto Anime Bot Running!\n\n🕘 Solo Leveling - Wed 9 AM\n🌙 Naruto - Wed 10 PM")
-
-async def main():
-    async with bot:
-        await schedule_jobs()
+start = core.register_commands(bot, process_anime, "🚀 Auto Anime Bot Running!")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(core.serve(bot, upload_pool, process_anime))
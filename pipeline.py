@@ -0,0 +1,421 @@
+import os
+import re
+import time
+import asyncio
+import shlex
+import shutil
+import signal
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Collection, Dict, Iterable, List, NamedTuple, Optional, Set, TypeVar
+
+from metrics import metrics, profile_job, span
+
+T = TypeVar("T")
+
+# ---------------- CONFIG ---------------- #
+MAX_MERGED_ON_DISK = int(os.environ.get("MAX_MERGED_ON_DISK", 2))
+MAX_JOBS = int(os.environ.get("MAX_JOBS", 4))                # episodes processed at once
+MAX_DOWNLOADS = int(os.environ.get("MAX_DOWNLOADS", 2))      # downloader commands at once
+MAX_UPLOADS = int(os.environ.get("MAX_UPLOADS", 2))          # Telegram uploads at once
+WORKSPACE_ROOT = os.environ.get("WORKSPACE_ROOT", "./jobs")
+FETCH_TIMEOUT = float(os.environ.get("FETCH_TIMEOUT", 3 * 3600))   # seconds per downloader attempt, 0 = none
+FETCH_RETRIES = int(os.environ.get("FETCH_RETRIES", 2))            # extra attempts after a failure
+FETCH_BACKOFF = float(os.environ.get("FETCH_BACKOFF", 30))         # first retry delay, doubled each time
+FETCH_OUTPUT_LINES = 200
+SCRATCH_RESERVE = int(os.environ.get("SCRATCH_RESERVE_MB", 2048)) * 2**20     # always left free on disk
+SCRATCH_ESTIMATE = int(os.environ.get("SCRATCH_ESTIMATE_MB", 4096)) * 2**20   # a job with nothing to go by
+SCRATCH_POLL = 10.0                                                          # seconds between free-space checks
+WORKSPACE_MAX_AGE = float(os.environ.get("WORKSPACE_MAX_AGE", 2 * 24 * 3600))   # untouched this long = stale
+SWEEP_INTERVAL = float(os.environ.get("SWEEP_INTERVAL", 3600))
+
+# Merges are bounded separately by media.MERGE_CONCURRENCY
+download_slots = asyncio.Semaphore(MAX_DOWNLOADS)
+upload_slots = asyncio.Semaphore(MAX_UPLOADS)
+
+
+# ---------------- WORKSPACES ---------------- #
+class Workspace(NamedTuple):
+    root: str
+    downloads: str
+    audio: str
+    merged: str
+
+
+def workspace_root(title: str, season: int, episode: int) -> str:
+    slug = re.sub(r"[^\w]+", "_", title).strip("_").lower()
+    return os.path.abspath(os.path.join(WORKSPACE_ROOT, f"{slug}_S{season:02d}E{episode:02d}"))
+
+
+def create_workspace(title: str, season: int, episode: int) -> Workspace:
+    """Private ./downloads, ./audio and ./merged for one episode job."""
+    root = workspace_root(title, season, episode)
+    workspace = Workspace(root, os.path.join(root, "downloads"), os.path.join(root, "audio"), os.path.join(root, "merged"))
+    for path in workspace[1:]:
+        os.makedirs(path, exist_ok=True)
+    return workspace
+
+
+def remove_workspace(workspace: Workspace):
+    shutil.rmtree(workspace.root, ignore_errors=True)
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def clear_dir(path: str):
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        if os.path.isdir(full):
+            shutil.rmtree(full, ignore_errors=True)
+        else:
+            os.remove(full)
+
+
+def discard_scratch(root: str) -> int:
+    """After a failed job: drop merged copies and half-written .part files, keep
+    the downloads its checkpoints can reuse. Returns the bytes freed."""
+    freed = 0
+    for path, _, files in os.walk(root):
+        for f in files:
+            full = os.path.join(path, f)
+            if os.path.basename(path) == "merged" or f.endswith(".part"):
+                freed += os.path.getsize(full)
+                os.remove(full)
+    return freed
+
+
+# ---------------- SCRATCH SPACE ---------------- #
+def free_space(path: str) -> int:
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+class DiskBudget:
+    """Admits jobs only when the scratch filesystem has room for them.
+
+    An admitted job holds a reservation for its estimated peak scratch size,
+    keyed by its directory. Whatever it hasn't written yet is taken off the free
+    space statvfs reports (minus `reserve`) before the next job is let in.
+    Estimates come from the last job with the same key, until a job refines its
+    own with resize() once its downloads are known.
+    """
+
+    def __init__(self, path: str, reserve: int = SCRATCH_RESERVE, default_estimate: int = SCRATCH_ESTIMATE):
+        self.path = path
+        self.reserve = reserve
+        self.default_estimate = default_estimate
+        self._reservations: Dict[str, int] = {}   # job directory -> estimated peak bytes
+        self._estimates: Dict[str, int] = {}      # key (show title, ...) -> last known peak bytes
+        self._changed = asyncio.Event()
+
+    def estimate(self, key: str) -> int:
+        return self._estimates.get(key, self.default_estimate)
+
+    def learn(self, key: str, nbytes: int):
+        self._estimates[key] = nbytes
+
+    def outstanding(self, exclude: Optional[str] = None) -> int:
+        """Bytes admitted jobs are still expected to write."""
+        return sum(
+            max(0, nbytes - (dir_size(root) if os.path.isdir(root) else 0))
+            for root, nbytes in self._reservations.items() if root != exclude
+        )
+
+    def usable(self, exclude: Optional[str] = None) -> int:
+        os.makedirs(self.path, exist_ok=True)
+        return free_space(self.path) - self.reserve - self.outstanding(exclude)
+
+    @property
+    def reserved(self) -> int:
+        return sum(self._reservations.values())
+
+    def active(self) -> Set[str]:
+        return set(self._reservations)
+
+    @asynccontextmanager
+    async def reserve_for(self, root: str, nbytes: int, name: str):
+        """Wait until `nbytes` (less what `root` already holds) fits, then hold it for the block."""
+        root = os.path.abspath(root)   # the sweep compares absolute paths
+        waited = False
+        while True:
+            need = nbytes - (dir_size(root) if os.path.isdir(root) else 0)
+            usable = self.usable(exclude=root)
+            # with nothing else admitted, waiting can't free anything we own
+            if need <= usable or (not self._reservations and usable > 0):
+                break
+            if not waited:
+                print(f"💾 {name} waits for scratch space: needs {need / 2**30:.1f} GiB, "
+                      f"{max(usable, 0) / 2**30:.1f} GiB usable")
+                metrics.inc("scratch_admission_waits")
+                waited = True
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), SCRATCH_POLL)
+            except asyncio.TimeoutError:
+                pass
+        self._reservations[root] = nbytes
+        try:
+            yield
+        finally:
+            del self._reservations[root]
+            self._changed.set()
+
+    def resize(self, root: str, nbytes: int, key: Optional[str] = None):
+        """Replace a held reservation with a better estimate.
+
+        Never waits: a job that is already running is let finish, later ones
+        are held back instead.
+        """
+        root = os.path.abspath(root)
+        if root in self._reservations:
+            self._reservations[root] = nbytes
+            self._changed.set()
+        if key:
+            self.learn(key, nbytes)
+
+    def freed(self):
+        self._changed.set()
+
+
+def sweep_workspaces(root: str, max_age: float = WORKSPACE_MAX_AGE, keep: Collection[str] = (),
+                     prefix: str = "") -> int:
+    """Delete directories under `root` not in `keep` and untouched for `max_age` seconds; returns bytes freed."""
+    if not os.path.isdir(root):
+        return 0
+    freed, now = 0, time.time()
+    for name in os.listdir(root):
+        path = os.path.abspath(os.path.join(root, name))
+        if not name.startswith(prefix) or not os.path.isdir(path) or path in keep:
+            continue
+        last = max(
+            [os.path.getmtime(path)] + [os.path.getmtime(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files]
+        )
+        if now - last > max_age:
+            size = dir_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            print(f"🧹 Removed stale scratch {name} ({size / 2**20:.0f} MiB)")
+            freed += size
+    return freed
+
+
+async def sweep_loop(budget: DiskBudget, interval: float = SWEEP_INTERVAL, max_age: float = WORKSPACE_MAX_AGE,
+                     prefix: str = "", resumable: Callable[[], Iterable[str]] = tuple):
+    """Sweep stale directories under budget.path every `interval` seconds, forever.
+
+    Directories of running jobs and those `resumable()` returns (jobs a restart
+    will pick up again, whose checkpoints point into them) are kept.
+    """
+    metrics.gauge("scratch_free_bytes", lambda: free_space(budget.path) if os.path.isdir(budget.path) else 0)
+    metrics.gauge("scratch_reserved_bytes", lambda: budget.reserved)
+    while True:
+        try:
+            keep = budget.active() | {os.path.abspath(path) for path in resumable()}
+            freed = await asyncio.to_thread(sweep_workspaces, budget.path, max_age, keep, prefix)
+        except Exception as e:   # a file vanishing mid-walk, permissions, ...: try again next round
+            print(f"⚠️ Scratch sweep of {budget.path} failed: {e!r}")
+            freed = 0
+        if freed:
+            metrics.add_bytes("swept", freed)
+            budget.freed()
+        await asyncio.sleep(interval)
+
+
+disk_budget = DiskBudget(WORKSPACE_ROOT)
+
+
+# ---------------- FETCH STAGE ---------------- #
+class CommandResult(NamedTuple):
+    cmd: str
+    returncode: Optional[int]   # None when the last attempt timed out
+    output: str                 # last FETCH_OUTPUT_LINES lines of stdout + stderr
+    attempts: int
+    elapsed: float
+
+
+class DownloadError(Exception):
+    """A downloader command failed on every attempt; `result` holds the last one."""
+
+    def __init__(self, result: CommandResult):
+        self.result = result
+        status = "timed out" if result.returncode is None else f"exited with {result.returncode}"
+        tail = result.output.strip().splitlines()[-1:] or ["no output"]
+        super().__init__(f"{result.cmd!r} {status} after {result.attempts} attempt(s): {tail[0]}")
+
+
+async def _run_once(cmd: str, cwd: Optional[str], env: Optional[Dict[str, str]], timeout: float) -> CommandResult:
+    # own process group, so a timeout also takes down whatever the downloader spawned
+    process = await asyncio.create_subprocess_exec(
+        *shlex.split(cmd), cwd=cwd, env=env, start_new_session=True,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    tail = deque(maxlen=FETCH_OUTPUT_LINES)
+    started = time.monotonic()
+
+    async def read_output():
+        buffer = ""
+        # progress bars redraw with \r and may never end a line, so read chunks
+        while chunk := await process.stdout.read(4096):
+            *lines, buffer = re.split(r"[\r\n]", buffer + chunk.decode(errors="replace"))
+            tail.extend(line for line in lines if line.strip())
+        if buffer.strip():
+            tail.append(buffer)
+        return await process.wait()
+
+    try:
+        returncode = await asyncio.wait_for(read_output(), timeout or None)
+    except asyncio.TimeoutError:
+        returncode = None
+    finally:
+        if process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await process.wait()
+    return CommandResult(cmd, returncode, "\n".join(tail), 1, time.monotonic() - started)
+
+
+async def fetch(cmd: str, workspace: Optional[Workspace] = None, output_dir: Optional[str] = None,
+                timeout: float = FETCH_TIMEOUT, retries: int = FETCH_RETRIES) -> CommandResult:
+    """Run a downloader command with a timeout, retrying with exponential backoff.
+
+    The command runs in the job workspace with DOWNLOAD_PATH/AUDIO_PATH pointing
+    into it; `output_dir` is emptied before a retry so a failed attempt's partial
+    files are never picked up. Raises DownloadError once every attempt failed.
+    """
+    env = cwd = None
+    if workspace:
+        env = dict(os.environ, DOWNLOAD_PATH=workspace.downloads, AUDIO_PATH=workspace.audio)
+        cwd = workspace.root
+    for attempt in range(1, retries + 2):
+        if attempt > 1:
+            delay = FETCH_BACKOFF * 2 ** (attempt - 2)
+            print(f"Retrying {cmd!r} in {delay:.0f}s (attempt {attempt}/{retries + 1})")
+            await asyncio.sleep(delay)
+            if output_dir:
+                clear_dir(output_dir)
+        async with download_slots:
+            with span("download"):
+                result = (await _run_once(cmd, cwd, env, timeout))._replace(attempts=attempt)
+        if result.returncode == 0:
+            return result
+        status = "timed out" if result.returncode is None else f"exited with {result.returncode}"
+        print(f"⚠️ {cmd!r} {status}:\n{result.output[-2000:]}")
+    metrics.inc("downloads_failed")
+    raise DownloadError(result)
+
+
+async def gather_or_fail(*aws: Awaitable[T]) -> List[T]:
+    """asyncio.gather, except the first failure cancels the rest before it is raised."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception():
+                raise task.exception()
+        return [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# ---------------- JOB SCHEDULER ---------------- #
+class JobScheduler:
+    """Priority queue of jobs served by a fixed pool of workers.
+
+    Lower `priority` runs first; equal priorities run in submission order.
+    """
+
+    def __init__(self, workers: int = MAX_JOBS):
+        self.workers = workers
+        self.active: Dict[int, str] = {}
+        self._queue: "asyncio.PriorityQueue" = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        metrics.gauge("jobs_queued", lambda: self.pending)
+        metrics.gauge("jobs_running", lambda: len(self.active))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def submit(self, name: str, job: Callable[[], Awaitable[object]], priority: int = 0):
+        """Queue `job()`; a coroutine so APScheduler runs it on the event loop."""
+        await self._queue.put((priority, next(self._seq), name, job))
+        print(f"Queued {name} ({self._queue.qsize()} waiting, {len(self.active)} running)")
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def join(self):
+        """Wait until every submitted job has finished."""
+        await self._queue.join()
+
+    async def _worker(self):
+        while True:
+            _, seq, name, job = await self._queue.get()
+            self.active[seq] = name
+            started = time.monotonic()
+            try:
+                with span("job"), profile_job(name):
+                    await job()
+                print(f"Job {name} finished in {time.monotonic() - started:.0f}s")
+            except Exception as e:
+                print(f"❌ Job {name} failed: {e!r}")
+            finally:
+                del self.active[seq]
+                self._queue.task_done()
+
+
+# ---------------- MERGE → UPLOAD PIPELINE ---------------- #
+async def run_pipeline(jobs: Iterable[T],
+                       merge: Callable[[T], Awaitable[object]],
+                       upload: Callable[[T], Awaitable[object]],
+                       max_on_disk: int = MAX_MERGED_ON_DISK):
+    """Merge job N+1 while job N uploads; uploads keep the order of `jobs`.
+
+    A merge only starts once one of `max_on_disk` slots is free, and the slot is
+    released after that job's upload returns (upload is expected to delete the
+    merged file), which caps the merged files sitting on disk.
+    """
+    queue: "asyncio.Queue" = asyncio.Queue(maxsize=max_on_disk)
+    slots = asyncio.Semaphore(max_on_disk)
+    merges: List[asyncio.Future] = []
+
+    async def merge_stage():
+        for job in jobs:
+            await slots.acquire()
+            task = asyncio.ensure_future(merge(job))
+            merges.append(task)
+            await queue.put((job, task))
+        await queue.put(None)
+
+    async def upload_stage():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            job, task = item
+            try:
+                await task
+                await upload(job)
+            finally:
+                slots.release()
+
+    producer = asyncio.ensure_future(merge_stage())
+    try:
+        await upload_stage()
+    finally:
+        producer.cancel()
+        for task in merges:
+            task.cancel()
+        await asyncio.gather(producer, *merges, return_exceptions=True)
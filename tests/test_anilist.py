@@ -0,0 +1,128 @@
+"""AniList lookups and poster thumbnails against benchmarks/stub_anilist.py."""
+import time
+import asyncio
+
+import pytest
+
+import data
+from stub_anilist import StubAniList
+
+
+@pytest.fixture
+def anilist(tmp_path, monkeypatch):
+    """Fresh caches, title index and batcher for each test; returns a runner for
+    coroutines that get a started stub as their argument."""
+    caches = iter(range(1000))
+
+    def fresh_cache():
+        return data.AniListCache(str(tmp_path / f"cache{next(caches)}.db"), 64, 3600, 60)
+
+    monkeypatch.setattr(data, "anilist_cache", fresh_cache())
+    monkeypatch.setattr(data, "title_index", data.TitleIndex(str(tmp_path / "titles.db"), 0.85))
+    monkeypatch.setattr(data, "anilist_batcher", data.AniListBatcher(0.01, 10, data.RateLimiter(600)))
+
+    def run(test, stub=None):
+        async def main():
+            stub_ = stub or StubAniList(latency=0)
+            monkeypatch.setattr(data, "ANILIST_URL", await stub_.start())
+            try:
+                return await test(stub_)
+            finally:
+                await data.close_session()
+                await stub_.stop()
+        return asyncio.run(main())
+
+    run.fresh_cache = fresh_cache
+    return run
+
+
+def test_index_hit_looks_up_by_id_alone(anilist, monkeypatch):
+    async def test(stub):
+        found = await data.fetch_anilist_data("Frieren Beyond Journeys End", 2023)
+        # forget the cached media so the misspelling has to go back to AniList
+        monkeypatch.setattr(data, "anilist_cache", anilist.fresh_cache())
+        again = await data.fetch_anilist_data("Frieren Beyond Journey End", 2023)
+        return found, again
+
+    found, again = anilist(test)
+    assert found["title"]["romaji"] == "Frieren Beyond Journeys End"
+    assert again["id"] == found["id"]
+
+
+def test_concurrent_lookups_share_one_aliased_request(anilist):
+    titles = ["Dandadan", "Kaiju No. 8", "Blue Lock", "Dandadan"]
+
+    async def test(stub):
+        return await asyncio.gather(*(data.fetch_anilist_data(t) for t in titles)), stub
+
+    results, stub = anilist(test)
+    assert [m["title"]["romaji"] for m in results] == titles
+    assert stub.requests == 1
+    assert sorted(v for k, v in stub.batches[0].items() if k[0] == "s") == ["Blue Lock", "Dandadan", "Kaiju No. 8"]
+
+
+def test_batches_split_at_max_batch(anilist):
+    async def test(stub):
+        await asyncio.gather(*(data.fetch_anilist_data(f"Show {chr(65 + i)}") for i in range(23)))
+        return stub
+
+    stub = anilist(test)
+    assert sorted(sum(k[0] == "s" for k in variables) for variables in stub.batches) == [3, 10, 10]
+
+
+def test_partial_errors_resolve_the_rest_and_cache_the_miss(anilist):
+    stub = StubAniList(latency=0)
+    stub.missing.add("No Such Show")
+
+    async def test(stub):
+        results = await asyncio.gather(*(data.fetch_anilist_data(t) for t in ["Dandadan", "No Such Show"]))
+        again = await data.fetch_anilist_data("No Such Show")
+        return results, again
+
+    (found, missing), again = anilist(test, stub)
+    assert found["title"]["romaji"] == "Dandadan"
+    assert missing == {} and again == {}
+    assert stub.requests == 1    # the miss was answered from the negative cache
+
+
+def test_negative_cache_expires(anilist, tmp_path, monkeypatch):
+    monkeypatch.setattr(data, "anilist_cache", data.AniListCache(str(tmp_path / "short.db"), 64, 3600, -1))
+    stub = StubAniList(latency=0)
+    stub.missing.add("No Such Show")
+
+    async def test(stub):
+        await data.fetch_anilist_data("No Such Show")
+        stub.missing.clear()
+        return await data.fetch_anilist_data("No Such Show")
+
+    assert anilist(test, stub)["title"]["romaji"] == "No Such Show"
+    assert stub.requests == 2
+
+
+def test_429_waits_for_retry_after(anilist):
+    stub = StubAniList(latency=0)
+    stub.throttle, stub.retry_after = 1, "0.3"
+
+    async def test(stub):
+        start = time.monotonic()
+        media = await data.fetch_anilist_data("Dandadan")
+        return media, time.monotonic() - start
+
+    media, elapsed = anilist(test, stub)
+    assert media["title"]["romaji"] == "Dandadan"
+    assert stub.requests == 2
+    assert elapsed >= 0.3
+
+
+def test_thumbnail_of_a_missing_poster_is_none_and_not_cached(anilist, tmp_path, monkeypatch):
+    monkeypatch.setattr(data, "THUMB_CACHE_DIR", str(tmp_path / "thumbs"))
+
+    async def test(stub):
+        missing = await data.make_thumbnail_from_url(f"{stub.url}/no-such-cover.jpg")
+        found = await data.make_thumbnail_from_url(f"{stub.url}/cover/1.jpg")
+        return missing, found
+
+    missing, found = anilist(test)
+    assert missing is None
+    assert found.getvalue()[:2] == b"\xff\xd8"   # JPEG
+    assert len(list((tmp_path / "thumbs").rglob("*.jpg"))) == 1
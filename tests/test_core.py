@@ -0,0 +1,58 @@
+"""Episode scheduling in core.py, with a fake process_episode and a scratch details DB."""
+import asyncio
+
+import pytest
+
+import core
+import details
+from pipeline import DiskBudget, JobScheduler
+
+
+@pytest.fixture
+def show(tmp_path, monkeypatch):
+    """Runs of core.run_episode are recorded as (episode, video_cmd) and complete the episode."""
+    monkeypatch.setattr(details, "DB_PATH", str(tmp_path / "details.db"))
+    monkeypatch.setattr(details, "_conn", None)
+    monkeypatch.setattr(core, "disk_budget", DiskBudget(str(tmp_path / "jobs"), reserve=0))
+    monkeypatch.setitem(core.SHOWS, "Naruto", ("nx --anime naruto", "crunchy --anime naruto"))
+    processed = []
+
+    async def process_episode(title, season, episode, video_cmd, audio_cmd):
+        processed.append((episode, video_cmd))
+        await asyncio.sleep(0)
+        details.complete_episode(title, episode)
+
+    async def process_anime(title, video_cmd, audio_cmd, episode=None):
+        await core.run_episode(process_episode, title, video_cmd, audio_cmd, episode)
+
+    yield process_anime, processed
+    if details._conn:
+        details._conn.close()
+
+
+def test_backfill_twice_processes_each_episode_once(show, monkeypatch):
+    process_anime, processed = show
+
+    async def main():
+        monkeypatch.setattr(core, "job_queue", JobScheduler(workers=1))
+        core.job_queue.start()
+        # both are queued before either runs, so the queue-time check can't catch the repeat
+        await core.backfill(process_anime, "Naruto", 188, 189)
+        await core.backfill(process_anime, "Naruto", 188, 189)
+        await core.job_queue.join()
+        await core.job_queue.stop()
+
+    asyncio.run(main())
+    assert [episode for episode, _ in processed] == [188, 189]
+    assert details.get_details("Naruto")["episode"] == 190
+
+
+def test_weekly_run_downloads_the_counter_episode_by_number(show):
+    process_anime, processed = show
+
+    async def main():
+        await core.weekly_episode(process_anime, "Naruto")
+        await core.weekly_episode(process_anime, "Naruto")
+
+    asyncio.run(main())
+    assert processed == [(188, "nx --anime naruto --episode 188"), (189, "nx --anime naruto --episode 189")]
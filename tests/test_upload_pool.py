@@ -0,0 +1,100 @@
+"""UploadPool dispatch and failover over benchmarks/mock_telegram.py clients."""
+import time
+import asyncio
+
+import pytest
+from pyrogram.errors import FloodWait
+
+import uploader
+from mock_telegram import MockClient
+from throttle import ApiThrottle
+from uploader import SESSION_COOLDOWN, SESSION_FAILURE_LIMIT, UploadPool
+
+CHAT_ID = 1234
+
+
+class FailingClient(MockClient):
+    """Raises `error` from every send_document."""
+
+    def __init__(self, bot_id: int, error: Exception):
+        super().__init__(bot_id)
+        self.error = error
+
+    async def send_document(self, chat_id, document, caption="", **kwargs):
+        self.calls += 1
+        raise self.error
+
+
+@pytest.fixture(autouse=True)
+def fresh_throttle(monkeypatch):
+    monkeypatch.setattr(uploader, "throttle", ApiThrottle())
+
+
+def test_concurrent_uploads_spread_over_sessions(tmp_path):
+    video = tmp_path / "ep.mkv"
+    video.write_bytes(b"\0" * 1_000_000)
+    clients = [MockClient(bot_id=i, uplink_mbps=80) for i in range(3)]
+    pool = UploadPool(clients)
+
+    async def main():
+        return await asyncio.gather(*(pool.send_document(CHAT_ID, str(video)) for _ in range(3)))
+
+    asyncio.run(main())
+    assert [c.uploaded for c in clients] == [1_000_000] * 3
+    assert all(s.active == 0 for s in pool.sessions)
+
+
+def test_idle_pool_prefers_the_first_session():
+    clients = [MockClient(bot_id=i) for i in range(2)]
+    pool = UploadPool(clients)
+
+    async def main():
+        for _ in range(2):
+            await pool.send_document(CHAT_ID, "file_id")
+
+    asyncio.run(main())
+    assert [c.calls for c in clients] == [2, 0]
+
+
+def test_failover_then_the_failed_session_is_avoided():
+    broken, spare = FailingClient(0, ConnectionError("reset")), MockClient(bot_id=1)
+    pool = UploadPool([broken, spare])
+
+    async def main():
+        return [await pool.send_document(CHAT_ID, "file_id") for _ in range(3)]
+
+    messages = asyncio.run(main())
+    assert all(m.document for m in messages)
+    assert broken.calls == 1 and spare.calls == 3
+    assert pool.sessions[0].failures == 1 and pool.sessions[0].healthy
+
+
+def test_session_benched_after_failure_limit():
+    pool = UploadPool([FailingClient(0, ConnectionError("reset"))])
+
+    async def main():
+        for _ in range(SESSION_FAILURE_LIMIT):
+            with pytest.raises(ConnectionError):
+                await pool.send_document(CHAT_ID, "file_id")
+
+    asyncio.run(main())
+    session = pool.sessions[0]
+    assert not session.healthy
+    assert session.benched_until >= time.monotonic() + SESSION_COOLDOWN - 5
+
+
+def test_all_sessions_failing_raises():
+    pool = UploadPool([FailingClient(i, ConnectionError("reset")) for i in range(2)])
+    with pytest.raises(ConnectionError):
+        asyncio.run(pool.send_document(CHAT_ID, "file_id"))
+
+
+def test_flood_wait_moves_on_without_counting_a_failure():
+    flooded, spare = FailingClient(0, FloodWait(value=30)), MockClient(bot_id=1)
+    pool = UploadPool([flooded, spare])
+
+    message = asyncio.run(pool.send_document(CHAT_ID, "file_id"))
+    assert message.document and spare.calls == 1
+    session = pool.sessions[0]
+    assert session.failures == 0
+    assert session.benched_until >= time.monotonic() + 25   # sits out the wait instead
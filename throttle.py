@@ -0,0 +1,158 @@
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from pyrogram import Client
+from pyrogram.errors import FloodWait, MessageNotModified
+
+T = TypeVar("T")
+
+# ---------------- CONFIG ---------------- #
+# Telegram's documented bot limits: ~30 messages/s overall, 1/s in a private
+# chat, 20/min in a group or channel. Edits count too.
+TG_GLOBAL_RATE = float(os.environ.get("TG_GLOBAL_RATE", 30))                 # per second, per bot
+TG_PRIVATE_CHAT_RATE = float(os.environ.get("TG_PRIVATE_CHAT_RATE", 1))      # per second
+TG_GROUP_CHAT_RATE = float(os.environ.get("TG_GROUP_CHAT_RATE", 20 / 60))    # per second
+TG_CHAT_BURST = int(os.environ.get("TG_CHAT_BURST", 3))
+FLOOD_WAIT_MAX_SLEEP = int(os.environ.get("FLOOD_WAIT_MAX_SLEEP", 600))      # longer waits are raised
+FLOOD_WAIT_RETRIES = 5
+
+
+# ---------------- TOKEN BUCKETS ---------------- #
+class TokenBucket:
+    """`rate` calls per second with bursts of up to `burst`; pause() blocks it outright."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._refill(time.monotonic())
+        self.tokens = 0.0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class _PendingEdit:
+    def __init__(self, kwargs: dict):
+        self.kwargs = kwargs
+        self.version = 0
+        self.done: "asyncio.Future" = asyncio.get_event_loop().create_future()
+
+
+# ---------------- API THROTTLE ---------------- #
+class ApiThrottle:
+    """Paces Bot API calls per bot: one global bucket plus one per chat.
+
+    A FloodWait pauses that chat's bucket for the requested time and the call is
+    retried, so later calls queue behind it instead of hitting the wall again.
+    (Pyrogram already sleeps through FloodWaits under its `sleep_threshold` itself.)
+    """
+
+    def __init__(self):
+        self._global: Dict[int, TokenBucket] = {}
+        self._chats: Dict[Tuple[int, object], TokenBucket] = {}
+        self._edits: Dict[tuple, _PendingEdit] = {}
+
+    def _chat_bucket(self, bot_id: int, chat_id) -> TokenBucket:
+        key = (bot_id, chat_id)
+        if key not in self._chats:
+            # negative ids are groups and channels
+            private = isinstance(chat_id, int) and chat_id > 0
+            self._chats[key] = TokenBucket(TG_PRIVATE_CHAT_RATE if private else TG_GROUP_CHAT_RATE, TG_CHAT_BURST)
+        return self._chats[key]
+
+    async def acquire(self, client: Client, chat_id):
+        """Wait for a slot to send to `chat_id` as `client`."""
+        bot_id = client.me.id
+        if bot_id not in self._global:
+            self._global[bot_id] = TokenBucket(TG_GLOBAL_RATE, TG_GLOBAL_RATE)
+        await self._chat_bucket(bot_id, chat_id).acquire()
+        await self._global[bot_id].acquire()
+
+    def backoff(self, client: Client, chat_id, seconds: float):
+        self._chat_bucket(client.me.id, chat_id).pause(seconds)
+
+    async def call(self, client: Client, chat_id, fn: Callable[[], Awaitable[T]],
+                   max_flood_wait: Optional[float] = None) -> T:
+        """await fn() once `client` may send to `chat_id`, sitting out FloodWaits.
+
+        FloodWaits longer than `max_flood_wait` (default FLOOD_WAIT_MAX_SLEEP) are
+        raised after pausing the bucket, e.g. so an upload pool can try another bot.
+        """
+        limit = FLOOD_WAIT_MAX_SLEEP if max_flood_wait is None else max_flood_wait
+        for attempt in range(FLOOD_WAIT_RETRIES + 1):
+            await self.acquire(client, chat_id)
+            try:
+                return await fn()
+            except FloodWait as e:
+                self.backoff(client, chat_id, e.value)
+                if e.value > limit or attempt == FLOOD_WAIT_RETRIES:
+                    raise
+                print(f"FloodWait {e.value}s in chat {chat_id}, backing off")
+
+    async def edit(self, client: Client, method: str, chat_id, message_id: int, **kwargs):
+        """client.<method>(chat_id, message_id, **kwargs), coalesced per message.
+
+        Edits that queue up behind the rate limit replace each other, so only the
+        newest content is sent; every caller gets the result of the send that
+        included (or superseded) its edit.
+        """
+        key = (client.me.id, method, chat_id, message_id)
+        pending = self._edits.get(key)
+        if pending is not None:
+            pending.kwargs = kwargs
+            pending.version += 1
+            return await asyncio.shield(pending.done)
+
+        pending = self._edits[key] = _PendingEdit(kwargs)
+        asyncio.ensure_future(self._flush_edit(key, client, method, chat_id, message_id))
+        return await asyncio.shield(pending.done)
+
+    async def _flush_edit(self, key, client: Client, method: str, chat_id, message_id: int):
+        pending = self._edits[key]
+        sent = [-1]
+
+        async def send():
+            # take the newest edit at the moment it actually goes out
+            sent[0] = pending.version
+            try:
+                return await getattr(client, method)(chat_id, message_id, **pending.kwargs)
+            except MessageNotModified:
+                return None
+
+        try:
+            result = await self.call(client, chat_id, send)
+            while pending.version != sent[0]:
+                # a newer edit arrived while that one was in flight
+                result = await self.call(client, chat_id, send)
+        except Exception as e:
+            pending.done.set_exception(e)
+        else:
+            pending.done.set_result(result)
+        finally:
+            del self._edits[key]
+
+
+throttle = ApiThrottle()
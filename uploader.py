@@ -0,0 +1,426 @@
+import os
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from pyrogram import Client, raw, types, utils
+from pyrogram.errors import FileIdInvalid, FileReferenceExpired, FileReferenceInvalid, FloodWait, MediaEmpty, RPCError
+from media import FFmpegError, MediaInfo, make_video_thumbnail, merge_video_audio, remux_stream
+from metrics import metrics, span
+from throttle import throttle
+
+# ---------------- CONFIG ---------------- #
+BIG_FILE_SIZE = 10 * 1024 * 1024      # Telegram only accepts streamed (size-less) uploads above this
+
+# Extra bots that share the upload load; each must be able to post in the target chats
+UPLOAD_BOT_TOKENS = [t for t in os.environ.get("UPLOAD_BOT_TOKENS", "").split(",") if t.strip()]
+SESSION_FAILURE_LIMIT = 3             # consecutive errors before a session is benched
+SESSION_COOLDOWN = 300                # seconds a benched session sits out
+
+FILE_ID_DB = os.environ.get("FILE_ID_DB", "file_ids.db")
+FILE_ID_MAX_ENTRIES = int(os.environ.get("FILE_ID_MAX_ENTRIES", 20000))
+FILE_ID_MAX_AGE = int(os.environ.get("FILE_ID_MAX_AGE", 60 * 24 * 3600))   # seconds since last use
+FILE_ID_EVICT_EVERY = 500             # inserts between evictions
+FILE_ID_EVICT_INTERVAL = 3600         # ... or seconds, for a bot that rarely uploads
+FINGERPRINT_SAMPLE = 1024 * 1024      # bytes hashed from the start, middle and end of a file
+
+# errors worth retrying on another session (file problems are not)
+FAILOVER_ERRORS = (RPCError, ConnectionError, asyncio.TimeoutError)
+# a cached file_id Telegram no longer accepts
+STALE_FILE_ID_ERRORS = (FileIdInvalid, FileReferenceExpired, FileReferenceInvalid, MediaEmpty)
+
+
+# ---------------- FILE ID CACHE ---------------- #
+def file_fingerprint(path: str) -> str:
+    """Cheap content hash: size plus 1 MiB samples from the start, middle and end.
+
+    Blocking; call through asyncio.to_thread for big files.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(0, size // 2 - FINGERPRINT_SAMPLE // 2), max(0, size - FINGERPRINT_SAMPLE)}):
+            f.seek(offset)
+            digest.update(f.read(FINGERPRINT_SAMPLE))
+    return digest.hexdigest()
+
+
+async def remux_cache_key(video_path: str, audio_path: str) -> str:
+    """Key for the MP4 made from this video + audio pair, known before (or without) merging."""
+    video, audio = await asyncio.gather(
+        asyncio.to_thread(file_fingerprint, video_path), asyncio.to_thread(file_fingerprint, audio_path)
+    )
+    return f"remux:{video}:{audio}"
+
+
+class FileIdCache:
+    """Persistent (key, bot) -> Telegram file_id map.
+
+    Keys are content fingerprints or "url:<url>". file_ids are only valid for the
+    bot that uploaded them, hence the bot id in the key. Entries unused for
+    FILE_ID_MAX_AGE are evicted, as are the least recently used beyond FILE_ID_MAX_ENTRIES,
+    on open and then every FILE_ID_EVICT_EVERY inserts or FILE_ID_EVICT_INTERVAL seconds.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._evicted = 0.0
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids (key TEXT NOT NULL, bot_id INTEGER NOT NULL, "
+                "file_id TEXT NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (key, bot_id))"
+            )
+            self._evict()
+        return self._db
+
+    def _evict(self):
+        self._inserts, self._evicted = 0, time.time()
+        self._db.execute("DELETE FROM file_ids WHERE last_used < ?", (time.time() - FILE_ID_MAX_AGE,))
+        self._db.execute(
+            "DELETE FROM file_ids WHERE rowid NOT IN "
+            "(SELECT rowid FROM file_ids ORDER BY last_used DESC LIMIT ?)", (FILE_ID_MAX_ENTRIES,)
+        )
+
+    def _maybe_evict(self):
+        if self._inserts >= FILE_ID_EVICT_EVERY or time.time() - self._evicted >= FILE_ID_EVICT_INTERVAL:
+            self._evict()
+
+    def get(self, key: str, bot_id: int) -> Optional[str]:
+        with self._lock:
+            db = self._conn()
+            self._maybe_evict()
+            row = db.execute("SELECT file_id FROM file_ids WHERE key = ? AND bot_id = ?", (key, bot_id)).fetchone()
+            if row:
+                db.execute("UPDATE file_ids SET last_used = ? WHERE key = ? AND bot_id = ?", (time.time(), key, bot_id))
+        return row[0] if row else None
+
+    def has(self, key: str, bot_id: Optional[int] = None) -> bool:
+        """Read-only: unlike get(), doesn't count as a use or trigger eviction."""
+        query, args = "SELECT 1 FROM file_ids WHERE key = ?", (key,)
+        if bot_id is not None:
+            query, args = query + " AND bot_id = ?", (key, bot_id)
+        with self._lock:
+            return self._conn().execute(query, args).fetchone() is not None
+
+    def put(self, key: str, bot_id: int, file_id: str):
+        with self._lock:
+            self._conn().execute("INSERT OR REPLACE INTO file_ids VALUES (?, ?, ?, ?)", (key, bot_id, file_id, time.time()))
+            self._inserts += 1
+            self._maybe_evict()
+
+    def drop(self, key: str, bot_id: int):
+        with self._lock:
+            self._conn().execute("DELETE FROM file_ids WHERE key = ? AND bot_id = ?", (key, bot_id))
+
+
+file_id_cache = FileIdCache(FILE_ID_DB)
+
+
+async def send_cached(client: Client, method: str, chat_id, key: str, media, **kwargs):
+    """client.<method>(chat_id, media) that re-sends by file_id if this bot already uploaded `key`.
+
+    With `media=None` only the cached file_id is tried (LookupError if there is none).
+    """
+    bot_id = client.me.id
+    file_id = file_id_cache.get(key, bot_id)
+    if file_id:
+        try:
+            message = await getattr(client, method)(chat_id, file_id, **kwargs)
+            metrics.inc("file_id_cache_hits")
+            return message
+        except STALE_FILE_ID_ERRORS:
+            file_id_cache.drop(key, bot_id)
+    if media is None:
+        raise LookupError(f"No usable file_id cached for {key}")
+
+    metrics.inc("file_id_cache_misses")
+    message = await getattr(client, method)(chat_id, media, **kwargs)
+    if isinstance(media, str) and os.path.isfile(media):
+        metrics.add_bytes("uploaded", os.path.getsize(media))
+    remember_file_id(client, key, message)
+    return message
+
+
+def remember_file_id(client: Client, key: str, message: Optional["types.Message"]):
+    media = getattr(message, message.media.value, None) if message and message.media else None
+    if media is not None:
+        file_id_cache.put(key, client.me.id, media.file_id)
+
+
+# ---------------- UPLOAD POOL ---------------- #
+class UploadSession:
+    def __init__(self, client: Client):
+        self.client = client
+        self.active = 0
+        self.failures = 0
+        self.benched_until = 0.0
+        self.reachable: Dict[int, bool] = {}
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.benched_until
+
+
+class UploadPool:
+    """Spreads uploads over several Telegram sessions.
+
+    Each upload goes to the healthy session with the fewest uploads in flight that
+    can see the target chat; on FloodWait or an RPC/connection error it moves on to
+    the next one. A session is benched for SESSION_COOLDOWN after
+    SESSION_FAILURE_LIMIT consecutive errors, or for the FloodWait duration.
+    """
+
+    def __init__(self, clients: List[Client]):
+        self.sessions = [UploadSession(c) for c in clients]
+        self._owned: List[Client] = []
+
+    @classmethod
+    def from_env(cls, primary: Client, api_id: int, api_hash: str, tokens: List[str] = UPLOAD_BOT_TOKENS):
+        helpers = [
+            Client(f"uploader_{i}", api_id=api_id, api_hash=api_hash, bot_token=token.strip(), in_memory=True)
+            for i, token in enumerate(tokens)
+        ]
+        pool = cls([primary, *helpers])
+        pool._owned = helpers
+        return pool
+
+    async def start(self):
+        """Start the helper sessions (the primary client is started by its owner)."""
+        await asyncio.gather(*(c.start() for c in self._owned))
+
+    async def stop(self):
+        await asyncio.gather(*(c.stop() for c in self._owned), return_exceptions=True)
+
+    async def _can_reach(self, session: UploadSession, chat_id) -> bool:
+        # checked once per chat so a helper never uploads a file only to be refused at SendMedia
+        if chat_id not in session.reachable:
+            try:
+                await session.client.get_chat(chat_id)
+                session.reachable[chat_id] = True
+            except RPCError:
+                session.reachable[chat_id] = False
+        return session.reachable[chat_id]
+
+    async def _pick(self, chat_id, exclude, prefer: Callable[[UploadSession], bool] = None) -> Optional[UploadSession]:
+        candidates = [s for s in self.sessions if s not in exclude]
+        # benched sessions are a last resort, not never
+        candidates.sort(key=lambda s: (not s.healthy, not (prefer and prefer(s)), s.active, s.failures))
+        for session in candidates:
+            if await self._can_reach(session, chat_id):
+                return session
+        return None
+
+    @asynccontextmanager
+    async def _use(self, session: UploadSession):
+        session.active += 1
+        try:
+            yield session.client
+        except FloodWait as e:
+            session.benched_until = time.monotonic() + e.value
+            raise
+        except FAILOVER_ERRORS:
+            session.failures += 1
+            if session.failures >= SESSION_FAILURE_LIMIT:
+                session.benched_until = time.monotonic() + SESSION_COOLDOWN
+            raise
+        else:
+            session.failures = 0
+        finally:
+            session.active -= 1
+
+    @asynccontextmanager
+    async def session(self, chat_id):
+        """Borrow the least-loaded client that can post to `chat_id`, tracking its health."""
+        session = await self._pick(chat_id, ())
+        if session is None:
+            raise RuntimeError(f"No upload session can reach chat {chat_id}")
+        async with self._use(session) as client:
+            await throttle.acquire(client, chat_id)
+            yield client
+
+    async def run(self, chat_id, fn: Callable[[Client], Awaitable], prefer: Callable[[UploadSession], bool] = None):
+        """await fn(client) on the best session for `chat_id`, failing over to the others."""
+        tried = []
+        while True:
+            session = await self._pick(chat_id, tried, prefer)
+            if session is None:
+                raise RuntimeError(f"No upload session can reach chat {chat_id}")
+            tried.append(session)
+            # sit out a FloodWait only when there is no other session left to try
+            max_flood_wait = 0 if len(tried) < len(self.sessions) else None
+            try:
+                async with self._use(session) as client:
+                    return await throttle.call(client, chat_id, lambda: fn(client), max_flood_wait)
+            except FAILOVER_ERRORS as e:
+                if len(tried) == len(self.sessions):
+                    raise
+                print(f"Upload via session {self.sessions.index(session)} failed ({e!r}), trying another")
+
+    async def call(self, method: str, chat_id, *args, **kwargs):
+        """client.<method>(chat_id, ...) on the best session, failing over to the others."""
+        return await self.run(chat_id, lambda client: getattr(client, method)(chat_id, *args, **kwargs))
+
+    async def send_cached(self, method: str, chat_id, key: str, media, **kwargs):
+        """Like call(), but sessions that already hold a file_id for `key` send it by reference."""
+        return await self.run(
+            chat_id,
+            lambda client: send_cached(client, method, chat_id, key, media, **kwargs),
+            prefer=lambda s: file_id_cache.has(key, s.client.me.id)
+        )
+
+    def is_cached(self, key: str) -> bool:
+        return file_id_cache.has(key)
+
+    async def send_video(self, chat_id, video, **kwargs):
+        return await self.call("send_video", chat_id, video, **kwargs)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        return await self.call("send_document", chat_id, document, **kwargs)
+
+
+# ---------------- STREAMED UPLOAD ---------------- #
+async def upload_stream(client: Client, chunks: AsyncIterator[bytes], file_name: str) -> "raw.base.InputFile":
+    """Upload parts as they are produced, without knowing the final size up front.
+
+    Chunks must all be the same size (a divisor of 512 KiB) except the last. Big
+    files use Telegram's streamed upload: every part is sent with a total of -1
+    except the last, so one chunk is held back until the stream ends.
+    """
+    file_id = client.rnd_id()
+    head, head_size = [], 0
+    part, held = 0, None
+
+    async for chunk in chunks:
+        metrics.add_bytes("uploaded", len(chunk))
+        if head is not None:
+            head.append(chunk)
+            head_size += len(chunk)
+            if head_size < BIG_FILE_SIZE:
+                continue
+            chunk, queued, head = head[-1], head[:-1], None
+        else:
+            queued = [held]
+        for data in queued:
+            await client.invoke(raw.functions.upload.SaveBigFilePart(
+                file_id=file_id, file_part=part, file_total_parts=-1, bytes=data
+            ))
+            part += 1
+        held = chunk
+
+    if head is not None:
+        # the whole stream fit under the big-file threshold
+        for part, data in enumerate(head):
+            await client.invoke(raw.functions.upload.SaveFilePart(file_id=file_id, file_part=part, bytes=data))
+        return raw.types.InputFile(id=file_id, parts=len(head), name=file_name, md5_checksum="")
+
+    await client.invoke(raw.functions.upload.SaveBigFilePart(
+        file_id=file_id, file_part=part, file_total_parts=part + 1, bytes=held
+    ))
+    return raw.types.InputFileBig(id=file_id, parts=part + 1, name=file_name)
+
+
+async def send_video_stream(client: Client, chat_id, chunks: AsyncIterator[bytes], file_name: str,
+                            caption: str = "", duration: int = 0, width: int = 0, height: int = 0,
+                            thumb: str = None) -> Optional["types.Message"]:
+    """send_video() for a file that only exists as a stream of chunks."""
+    file = await upload_stream(client, chunks, file_name)
+    r = await client.invoke(
+        raw.functions.messages.SendMedia(
+            peer=await client.resolve_peer(chat_id),
+            media=raw.types.InputMediaUploadedDocument(
+                mime_type="video/mp4",
+                file=file,
+                thumb=await client.save_file(thumb) if thumb else None,
+                attributes=[
+                    raw.types.DocumentAttributeVideo(duration=duration, w=width, h=height, supports_streaming=True),
+                    raw.types.DocumentAttributeFilename(file_name=file_name),
+                ],
+            ),
+            random_id=client.rnd_id(),
+            **await utils.parse_text_entities(client, caption, None, None)
+        )
+    )
+    for update in r.updates:
+        if isinstance(update, (raw.types.UpdateNewMessage, raw.types.UpdateNewChannelMessage)):
+            return await types.Message._parse(
+                client, update.message, {u.id: u for u in r.users}, {c.id: c for c in r.chats}
+            )
+    return None
+
+
+async def send_remuxed_video(pool: UploadPool, chat_id, video_path: str, audio_path: str, merged_file: str,
+                             caption: str, streamed: bool, cache_key: str = None,
+                             info: Optional[MediaInfo] = None) -> Optional["types.Message"]:
+    """Upload video + audio as one MP4.
+
+    With `streamed` the remux is piped straight into the upload and `merged_file`
+    is never written; if ffmpeg cannot stream the pair after all, it falls back to
+    merging into `merged_file` first. Without it, `merged_file` must already exist.
+    If `cache_key` was uploaded before, the earlier file_id is sent instead.
+    `info` (the probed video) adds duration, dimensions and a thumbnail, so
+    Telegram can play the upload without processing it first.
+    """
+    if cache_key and pool.is_cached(cache_key):
+        try:
+            return await pool.send_cached("send_video", chat_id, cache_key, None,
+                                          caption=caption, supports_streaming=True)
+        except LookupError:
+            pass  # stale file_id: upload again below
+
+    meta, thumb = {}, None
+    if info is not None:
+        meta = {"duration": int(info.duration), "width": info.width, "height": info.height}
+        thumb = await make_video_thumbnail(video_path, os.path.splitext(merged_file)[0] + "_thumb.jpg", info.duration)
+    try:
+        return await _upload_remuxed(pool, chat_id, video_path, audio_path, merged_file, caption, streamed,
+                                     cache_key, dict(meta, thumb=thumb))
+    finally:
+        if thumb:
+            os.remove(thumb)
+
+
+async def _upload_remuxed(pool: UploadPool, chat_id, video_path: str, audio_path: str, merged_file: str,
+                          caption: str, streamed: bool, cache_key: Optional[str], meta: dict):
+    if streamed:
+        try:
+            # a stream can't be replayed, so no failover here
+            async with pool.session(chat_id) as client:
+                with span("upload"):
+                    message = await send_video_stream(
+                        client, chat_id, remux_stream(video_path, audio_path), os.path.basename(merged_file), caption,
+                        **meta
+                    )
+                if cache_key:
+                    remember_file_id(client, cache_key, message)
+                return message
+        except FFmpegError as e:
+            print(f"Streaming upload failed ({e}), merging to disk instead")
+            await merge_video_audio(video_path, audio_path, merged_file)
+
+    if not os.path.exists(merged_file):
+        # the merge stage skipped it because the file_id looked reusable
+        await merge_video_audio(video_path, audio_path, merged_file)
+    with span("upload"):
+        if cache_key:
+            return await pool.send_cached("send_video", chat_id, cache_key, merged_file,
+                                          caption=caption, supports_streaming=True, **meta)
+        message = await pool.send_video(
+            chat_id,
+            merged_file,
+            caption=caption,
+            supports_streaming=True,
+            **meta
+        )
+    metrics.add_bytes("uploaded", os.path.getsize(merged_file))
+    return message